@@ -0,0 +1,81 @@
+'''Regression check and benchmark of tools.refseq.collapse_refseq.
+
+Compares collapse_refseq with collapse_gene_refseq applied gene by gene, in
+first-last (outer and inner cds) and longest-cds modes, and times both.
+Uses a synthetic chromosome, with copies of some transcripts under other
+names so that cds lengths tie, unless a refseq parquet is given. Run from
+the repository root:
+
+    python -m benchmarks.bench_collapse_refseq
+    python -m benchmarks.bench_collapse_refseq --data-path processed_data \
+        --assembly hg38 --chrom chr1
+'''
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_exon_regions import make_refseq
+from tools.refseq import collapse_gene_refseq, collapse_refseq
+
+
+def add_tied_transcripts(refseq: pd.DataFrame, fraction: float = 0.2,
+                         seed: int = 0) -> pd.DataFrame:
+    # Copies of some transcripts with another name, and for half of them a
+    # cds shifted by one base, keeping the cds length
+    rng = np.random.default_rng(seed)
+    copies = refseq.sample(frac=fraction, random_state=seed).copy()
+    copies['name'] = copies['name'] + '_copy'
+    shift = rng.random(len(copies)) < 0.5
+    copies.loc[shift, ['cdsStart', 'cdsEnd']] -= 1
+
+    return pd.concat([refseq, copies]).sample(frac=1, random_state=seed,
+                                              ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-path')
+    parser.add_argument('--assembly', default='hg38')
+    parser.add_argument('--chrom', default='chr1')
+    parser.add_argument('--genes', type=int, default=500,
+                        help='genes of the synthetic chromosome')
+    args = parser.parse_args()
+
+    if args.data_path:
+        from tools.load_data import load_gene_annotations
+        refseq = load_gene_annotations(args.data_path,
+                                       assembly=args.assembly)
+        refseq = refseq.query('chrom == @args.chrom')
+    else:
+        refseq = add_tied_transcripts(make_refseq(args.genes, args.chrom))
+    print(f'{args.chrom}: {refseq.name_chrom.nunique():,} genes, '
+          f'{len(refseq):,} transcripts')
+
+    print(f'{"mode":>22} {"per gene (s)":>13} {"bulk (s)":>9} '
+          f'{"speedup":>8}')
+    for mode, outer_cds in (('first-last', True), ('first-last', False),
+                            ('longest-cds', True)):
+        t0 = time.perf_counter()
+        # collapse_gene_refseq prints genes whose longest cds does not
+        # start first
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = refseq.groupby('name_chrom').apply(
+                collapse_gene_refseq, outer_cds=outer_cds, mode=mode)
+        t_gene = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        result = collapse_refseq(refseq, outer_cds=outer_cds, mode=mode)
+        t_bulk = time.perf_counter() - t0
+
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        label = f'{mode}{"" if outer_cds else " (inner)"}'
+        print(f'{label:>22} {t_gene:>13.2f} {t_bulk:>9.3f} '
+              f'{t_gene / t_bulk:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
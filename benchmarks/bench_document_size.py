@@ -0,0 +1,92 @@
+'''Measures the websocket bytes sent to the browser per gene load.
+
+Builds the insertion plots as plot_ins does in insertion-browser.py, attaches
+them to a document and records the PATCH-DOC message Bokeh would send when
+the plots replace the previous ones (as in update_gene). Compares a range
+selector with its own ColumnDataSource against one sharing the main plot's
+source, and both against updating the sources of the existing plots (as
+BrowserView.show does). Run from the repository root:
+
+    python -m benchmarks.bench_document_size --sizes 10000 100000
+'''
+import argparse
+
+from bokeh.document import Document
+from bokeh.document.events import DocumentPatchedEvent
+from bokeh.layouts import column, row
+from bokeh.models import Div
+from bokeh.protocol import Protocol
+
+from benchmarks.bench_encode_insertions import make_insertions
+from tools.metrics import message_size
+from tools.plotting.insertions import InsertionPlot
+
+
+def patch_size(doc: Document, func) -> int:
+    # Bytes of the PATCH-DOC message generated by the changes made by func
+    events = []
+
+    def record(event):
+        # Session callbacks added by func are not sent to the browser
+        if isinstance(event, DocumentPatchedEvent):
+            events.append(event)
+
+    doc.on_change(record)
+    func()
+    doc.remove_on_change(record)
+
+    return message_size(Protocol().create('PATCH-DOC', events))
+
+
+def insertion_plots(insertions, start, end, padd, shared_source):
+    ins = InsertionPlot(insertions, 'screen', 'hg38', 'chr1', start, end,
+                        jitter_ins=True, load_padd=padd)
+    ins.hover_position()
+    source = ins.source if shared_source else None
+    select = InsertionPlot(insertions, 'screen', 'hg38', 'chr1', start, end,
+                           jitter_ins=True, load_padd=padd, source=source)
+    select.for_selection(ins.plt)
+
+    return ins, select, column(ins.div_title, ins.plt, select.plt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    args = parser.parse_args()
+
+    padd = 200000
+    start, end = padd, padd + 10000
+
+    print(f'{"n":>9} {"separate (bytes)":>17} {"shared (bytes)":>15} '
+          f'{"in place (bytes)":>17}')
+    for n in args.sizes:
+        insertions = make_insertions(n)
+        sizes = []
+        for shared_source in (False, True):
+            layout = row(Div(), column())
+            doc = Document()
+            doc.add_root(layout)
+
+            def load_gene():
+                layout.children[1] = insertion_plots(insertions, start, end,
+                                                     padd, shared_source)[2]
+
+            sizes.append(patch_size(doc, load_gene))
+
+        ins, select, plots = insertion_plots(insertions, start, end, padd,
+                                             True)
+        doc = Document()
+        doc.add_root(row(Div(), plots))
+
+        def update_gene():
+            for plot in (ins, select):
+                plot.update(insertions, 'screen', 'hg38', 'chr2', start, end)
+
+        sizes.append(patch_size(doc, update_gene))
+        print(f'{n:>9,} {sizes[0]:>17,} {sizes[1]:>15,} {sizes[2]:>17,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''Micro-benchmark of the insertion source encoding in InsertionPlot.
+
+Compares the row-wise DataFrame.apply encoding that set_source used before
+with tools.plotting.insertions.encode_insertions on synthetic windows, and
+checks that both produce the same lanes and colors. Run from the repository
+root:
+
+    python -m benchmarks.bench_encode_insertions --sizes 10000 100000 1000000
+'''
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from bokeh.palettes import PiYG8
+
+from tools.plotting.insertions import encode_insertions, lane_palette
+
+
+def encode_insertions_apply(q_ins: pd.DataFrame, screen_type: str = 'ip',
+                            strand=None) -> pd.DataFrame:
+    # Row-wise encoding as previously done in InsertionPlot.set_source
+    q_ins = q_ins.copy()
+    if screen_type == 'ip' or screen_type == 'pa':
+        if strand:
+            ins_colors = {'h': '#f7b784', 'l': '#3381bd'}
+            ins_pos = {'h': 2, 'l': 1}
+            q_ins['color'] = q_ins.apply(
+                lambda x: ins_colors[x['chan'][0]], axis=1)
+            q_ins['ypos'] = q_ins.apply(
+                lambda x: ins_pos[x['chan'][0]], axis=1)
+        else:
+            ins_colors = {'h+': '#f7b784', 'l+': '#3381bd',
+                          'h-': '#f7b784', 'l-': '#3381bd'}
+            ins_pos = {'h+': 4.5, 'l+': 2, 'h-': 3.5, 'l-': 1}
+            q_ins['color'] = q_ins.apply(
+                lambda x: ins_colors[x['chan'][0] + x['strand'][0]], axis=1)
+            q_ins['ypos'] = q_ins.apply(
+                lambda x: ins_pos[x['chan'][0] + x['strand'][0]], axis=1)
+    elif screen_type == 'sl':
+        ins_colors = {'+': PiYG8[-1], '-': PiYG8[0]}
+        ins_pos = {'4-': 1, '4+': 2, '3-': 4, '3+': 5, '2-': 7, '2+': 8,
+                   '1-': 10, '1+': 11}
+        q_ins['color'] = q_ins.apply(
+            lambda x: ins_colors[x['strand'][0]], axis=1)
+        q_ins['ypos'] = q_ins.apply(
+            lambda x: ins_pos[str(x['replicate'][0]) + x['strand'][0]],
+            axis=1)
+    q_ins['xpos'] = q_ins.apply(lambda x: x['pos'], axis=1)
+
+    return q_ins
+
+
+def make_insertions(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'pos': np.sort(rng.integers(0, 400000, n)),
+                         'chan': rng.choice(['high', 'low'], n),
+                         'strand': rng.choice(['+', '-'], n),
+                         'replicate': rng.choice(['1', '2', '3', '4'], n)})
+
+
+def timeit(func, *args, repeat=1, **kwargs) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--screen-types', nargs='+', default=['ip', 'sl'])
+    args = parser.parse_args()
+
+    print(f'{"screen":>6} {"n":>9} {"apply (s)":>10} {"vector (s)":>11} '
+          f'{"speedup":>8}')
+    for screen_type in args.screen_types:
+        for n in args.sizes:
+            ins = make_insertions(n)
+
+            expected = encode_insertions_apply(ins, screen_type)
+            result = encode_insertions(ins, screen_type)
+            # Lanes are colored in the browser, compare their colors
+            colors = np.array(lane_palette(screen_type), dtype=object)
+            result = result.assign(color=colors[result['lane'].values])
+            pd.testing.assert_frame_equal(result[expected.columns], expected,
+                                          check_dtype=False)
+
+            t_apply = timeit(encode_insertions_apply, ins, screen_type)
+            t_vector = timeit(encode_insertions, ins, screen_type, repeat=5)
+            print(f'{screen_type:>6} {n:>9,} {t_apply:>10.3f} '
+                  f'{t_vector:>11.4f} {t_apply / t_vector:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+'''Benchmark of tools.refseq.get_exon_regions.
+
+Times the interval clipping get_exon_regions against the per-base
+implementation it replaced, for the grouped call used by TranscriptPlot.
+get_exon_regions_per_base is also the oracle of tests/test_refseq.py. Uses a
+synthetic chromosome unless a refseq parquet is given. Run from the
+repository root:
+
+    python -m benchmarks.bench_exon_regions
+    python -m benchmarks.bench_exon_regions --data-path processed_data \
+        --assembly hg38 --chrom chr1
+'''
+import argparse
+import time
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from tools.refseq import get_exon_regions
+
+
+def contig_list_lims(lst):
+    lims = []
+    for k, g in groupby(enumerate(lst), lambda x: x[0] - x[1]):
+        x = list(map(itemgetter(1), g))
+        lims.append([x[0], x[-1] + 1])
+    return lims
+
+
+def get_exon_regions_per_base(gene_pos: pd.DataFrame) -> pd.DataFrame:
+    # Previous implementation of get_exon_regions, testing every exon base
+    # for membership of the cds
+    exon = gene_pos.copy(deep=True)
+    exon = exon.reset_index(drop=True)
+    exon['tx_id'] = exon.index + 1
+
+    cols = ['exonStarts', 'exonEnds']
+    exon[cols] = exon[cols].applymap(lambda x: x.split(','))
+
+    exon['cdsRange'] = exon.apply(lambda x: range(x.cdsStart, x.cdsEnd),
+                                  axis=1)
+    exon['exonRange'] = (exon
+                         .apply(lambda t:
+                                [range(int(x), int(y)) for i, x
+                                 in enumerate(t['exonStarts']) for j, y
+                                 in enumerate(t['exonEnds']) if i == j
+                                 and x != '' and y != ''], axis=1))
+
+    exon = exon.explode('exonRange')
+    exon = exon.reset_index(drop=True)
+    exon['exon_id'] = exon.index + 1
+    exon = exon.drop(columns=['exonStarts', 'exonEnds',
+                              'cdsStartStat', 'cdsEndStat',
+                              'cdsStart', 'cdsEnd'])
+
+    exon['exCds_lst'] = exon.apply(lambda t: [x for x in t.exonRange
+                                              if x in t.cdsRange], axis=1)
+    exon['exUtr_lst'] = exon.apply(lambda t: [x for x in t.exonRange
+                                              if x not in t.cdsRange], axis=1)
+
+    exon['exCds'] = exon.apply(lambda t: contig_list_lims(t.exCds_lst), axis=1)
+    exon['exUtr'] = exon.apply(lambda t: contig_list_lims(t.exUtr_lst), axis=1)
+
+    exon_regions = exon.melt(id_vars=['name2', 'name', 'exon_id', 'tx_id'],
+                             value_vars=['exCds', 'exUtr'],
+                             var_name='reg_type', value_name='reg_lims')
+    exon_regions = exon_regions.explode('reg_lims').dropna()
+
+    return exon_regions
+
+
+def make_refseq(genes: int = 2000, chrom: str = 'chr1',
+                seed: int = 0) -> pd.DataFrame:
+    # Synthetic refseq table with exon and utr sizes similar to human genes
+    rng = np.random.default_rng(seed)
+    rows = []
+    for g in range(genes):
+        gene_start = int(rng.integers(0, 200_000_000))
+        strand = rng.choice(['+', '-'])
+        for t in range(int(rng.integers(1, 5))):
+            n_exons = int(rng.integers(1, 20))
+            introns = rng.integers(200, 10000, n_exons)
+            lengths = rng.integers(50, 400, n_exons)
+            lengths[[0, -1]] += rng.integers(100, 3000, 2)
+            starts = gene_start + np.cumsum(introns) + np.concatenate(
+                [[0], np.cumsum(lengths)[:-1]])
+            ends = starts + lengths
+            if rng.random() < 0.9:
+                cds_start = int(rng.integers(starts[0], ends[0]))
+                cds_end = int(rng.integers(starts[-1], ends[-1]))
+                cds_end = max(cds_start, cds_end)
+            else:
+                cds_start = cds_end = int(ends[-1])
+            rows.append({
+                'name': f'NM_{g}.{t}', 'chrom': chrom, 'strand': strand,
+                'txStart': int(starts[0]), 'txEnd': int(ends[-1]),
+                'cdsStart': cds_start, 'cdsEnd': cds_end,
+                'exonCount': n_exons,
+                'exonStarts': ','.join(map(str, starts)) + ',',
+                'exonEnds': ','.join(map(str, ends)) + ',',
+                'name2': f'GENE{g}', 'cdsStartStat': 'cmpl',
+                'cdsEndStat': 'cmpl', 'known': True, 'coding': True,
+                'name_chrom': f'GENE{g}'})
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-path')
+    parser.add_argument('--assembly', default='hg38')
+    parser.add_argument('--chrom', default='chr1')
+    parser.add_argument('--genes', type=int, default=2000,
+                        help='genes of the synthetic chromosome')
+    args = parser.parse_args()
+
+    if args.data_path:
+        from tools.load_data import load_gene_annotations
+        refseq = load_gene_annotations(args.data_path,
+                                       assembly=args.assembly)
+        refseq = refseq.query('chrom == @args.chrom')
+    else:
+        refseq = make_refseq(args.genes, args.chrom)
+    print(f'{args.chrom}: {refseq.name_chrom.nunique():,} genes, '
+          f'{len(refseq):,} transcripts')
+
+    t0 = time.perf_counter()
+    refseq.groupby('name_chrom').apply(get_exon_regions_per_base)
+    t_base = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    get_exon_regions(refseq, by='name_chrom')
+    t_interval = time.perf_counter() - t0
+
+    print(f'per-base: {t_base:.2f} s, interval: {t_interval:.3f} s '
+          f'({t_base / t_interval:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
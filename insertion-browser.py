@@ -1,6 +1,7 @@
 # %%
 # from bokeh.events import DocumentReady
-import os
+from functools import partial
+import pandas as pd
 from importlib import reload
 from bokeh.layouts import column, row
 from bokeh.plotting import output_file, show, curdoc
@@ -10,32 +11,40 @@ from bokeh.models import (AutocompleteInput, Div, TextInput,
 from tools.load_data import *
 import tools.plotting.insertions as pltins
 import tools.plotting.transcripts as plttx
+import tools.plotting.browser as pltbrowser
+import tools.plotting.overview as pltoverview
+from tools.loader import SessionLoader
+from tools.metrics import SHOW_IN_UI, Trace, metrics
+from tools.prefetch import prefetcher
 
-data_path = 'gs://gisetia-insertion-browser/processed_data'
-if os.uname().sysname == 'Darwin':
-    data_path = 'processed_data'
+data_path = DATA_PATH
 
 # %%
 menu_margins = (20, 0, 0, 0)
 menu_width = 150
 txt_out = Div(text='', margin=menu_margins, width=menu_width)
+stats_out = Div(text='', margin=menu_margins, width=menu_width)
+metrics_out = Div(text='', margin=menu_margins, width=menu_width,
+                  visible=SHOW_IN_UI)
 
 assembly = 'hg38'
 screen_name = 'screenA'
 gene = 'JAK2'
 
 padd = 200000
+# Wider ranges (bp) show binned insertion counts instead of insertions
+lod_threshold = 100000
+# Delay (ms) after the last range change before loading flanking insertions
+stream_delay = 300
 
 txt_out.text = 'Loading gene annotations...'
 
 print('Loading refseq...')
 
-refseq = load_gene_annotations(data_path, assembly=assembly)
+refseq = get_gene_annotations(data_path, assembly=assembly)
 
-gene_pos = refseq.query('name_chrom == @gene')
-chrom = gene_pos.chrom.head(1).values[0]
-start = gene_pos.txStart.min()
-end = gene_pos.txEnd.max()
+gene_symbols = get_gene_symbols(data_path, assembly=assembly)
+chrom, start, end = gene_symbols.lookup(gene)
 
 txt_out.text = 'Loading screen insertions...'
 print('Loading insertions...')
@@ -46,6 +55,13 @@ txt_out.text = ''
 # %%
 reload(pltins)
 reload(plttx)
+reload(pltbrowser)
+reload(pltoverview)
+
+view = None
+# Data of the session is loaded in background threads, see tools.loader
+loader = SessionLoader(curdoc())
+stream_loader = SessionLoader(curdoc())
 
 
 def plot_ins(insertions, screen_name, chrom, start, end, refseq,
@@ -53,34 +69,138 @@ def plot_ins(insertions, screen_name, chrom, start, end, refseq,
 
     print(f'Plotting for {screen_name} - {assembly} - {chrom}:{start}-{end}')
 
-    # print('Creating plots...')
-    ins = pltins.InsertionPlot(insertions, screen_name, assembly, chrom,
-                               start, end, screen_type=screen_type,
-                               jitter_ins=True, load_padd=padd)
-    ins.hover_position()
+    global view
+    gene_index = get_gene_index(data_path, assembly=assembly)
+
+    # Reuse the plots of the session and only update their data, unless the
+    # lanes of the insertion plot change
+    if view is not None and view.screen_type == screen_type:
+        view.show(insertions, screen_name, assembly, chrom, start, end,
+                  refseq, gene_index=gene_index)
+        return view.plots
+
+    view = pltbrowser.BrowserView(insertions, screen_name, assembly, chrom,
+                                  start, end, refseq,
+                                  screen_type=screen_type, load_padd=padd,
+                                  lod_threshold=lod_threshold,
+                                  gene_index=gene_index, data_path=data_path)
+    view.ins.plt.x_range.on_change('start', schedule_stream)
+    view.ins.plt.x_range.on_change('end', schedule_stream)
 
-    select = pltins.InsertionPlot(insertions, screen_name, assembly, chrom,
-                                  start, end, screen_type=screen_type,
-                                  jitter_ins=True, load_padd=padd)
-    select.for_selection(ins.plt)
+    return view.plots
 
-    transcript = plttx.TranscriptPlot(refseq, assembly, chrom, start, end,
-                                      load_padd=padd)
-    transcript.link_ins(ins.plt)
-    global transcr
-    transcr = transcript.transcripts
 
-    plots = column(ins.div_title, transcript.plt, ins.plt, select.plt,
-                   name='plots')
+def show_plots(plots):
+    # Only replace the plots in the layout when new ones were created
+    if main.children[1] is not plots:
+        main.children[1] = plots
+
+
+def overview_density(screen_name, assembly):
+    # Genome-wide density of a screen, empty if it was not built (see
+    # tools.build_density)
+    try:
+        return get_genome_density(data_path, screen_name, assembly=assembly)
+    except OSError:
+        return pd.DataFrame(columns=['chrom', 'start', 'end'])
 
-    # print(transcr)
-    # plots = column(transcript.plt, ins.plt)
 
-    return plots
+def gene_stats_text(screen_name, assembly, gene):
+    # Insertion counts of the shown gene (see tools.build_gene_stats)
+    if gene is None:
+        return ''
+    try:
+        stats = get_gene_stats(data_path, screen_name, assembly=assembly)
+    except OSError:
+        return ''
+    if gene not in stats.index:
+        return ''
+
+    counts = stats.loc[gene]
+    rows = ''.join(f'<tr><td>{chan}</td>'
+                   f'<td>{counts[chan.lower() + "_sense"]:,}</td>'
+                   f'<td>{counts[chan.lower() + "_antisense"]:,}</td></tr>'
+                   for chan in ('High', 'Low'))
+
+    return (f'<b>{gene}</b> insertions<table><tr><th></th><th>Sense</th>'
+            f'<th>Antisense</th></tr>{rows}</table>')
+
+
+def select_region(chrom, start, end):
+    # Show a region tapped in the overview as a typed position
+    pos_input.value = f'{chrom}:{start + 1:,}-{end:,}'
+
+
+stream_callback = None
+
+
+def schedule_stream(attr, old, new):
+    # Debounce range changes while the user pans or zooms
+    global stream_callback
+    if stream_callback is not None:
+        curdoc().remove_timeout_callback(stream_callback)
+    stream_callback = curdoc().add_timeout_callback(stream_flanks,
+                                                    stream_delay)
+
+
+def stream_flanks():
+    # Load insertions next to the loaded window when the visible range gets
+    # closer than one range width to its edges
+    global stream_callback
+    stream_callback = None
+
+    ins = view.ins
+    x_range = ins.plt.x_range
+    width = x_range.end - x_range.start
+
+    flanks = []
+    if x_range.start - ins.load_start < width and ins.load_start > 0:
+        flanks.append((max(ins.load_start - padd, 0), ins.load_start - 1))
+    # Insertions end at the last one of the chromosome, whose file footer
+    # was read when the window was loaded
+    last_pos = last_insertion(data_path, ins.screen, ins.assembly, ins.chrom)
+    if (ins.load_end - x_range.end < width
+            and (last_pos is None or ins.load_end < last_pos)):
+        flank_end = ins.load_end + padd
+        if last_pos is not None:
+            flank_end = min(flank_end, last_pos)
+        flanks.append((ins.load_end + 1, flank_end))
+
+    if flanks:
+        stream_loader.submit(partial(load_flanks, ins.screen, ins.assembly,
+                                     ins.chrom, flanks),
+                             show_flanks, show_error)
+
+
+def load_flanks(screen_name, assembly, chrom, flanks):
+    # Runs in the loader threads
+    return [(screen_name, assembly, chrom, flank_start, flank_end,
+             load_insertions(data_path, screen_name, chrom, flank_start,
+                             flank_end, assembly=assembly))
+            for flank_start, flank_end in flanks]
+
+
+def show_flanks(flanks):
+    ins = view.ins
+    for screen_name, assembly, chrom, flank_start, flank_end, flank in flanks:
+        # Skip flanks of a window that is no longer shown
+        if ((screen_name, assembly, chrom) != (ins.screen, ins.assembly,
+                                               ins.chrom)
+                or (flank_end != ins.load_start - 1
+                    and flank_start != ins.load_end + 1)):
+            continue
+        ins.extend(flank, flank_start, flank_end)
+        view.select.extend(flank, flank_start, flank_end)
 
 
 plots = plot_ins(insertions, screen_name, chrom, start, end, refseq)
 
+overview = pltoverview.OverviewPlot(overview_density(screen_name, assembly),
+                                    screen_name, assembly,
+                                    on_select=select_region)
+overview.show_window(chrom, start, end)
+stats_out.text = gene_stats_text(screen_name, assembly, gene)
+
 
 # Menus
 pos_input = TextInput(title='1-based position', value='',
@@ -95,38 +215,126 @@ screen_menu = Select(title='Select screen', value='screenA',
 assembly_opts = ['hg19', 'hg38']
 assembly_menu = RadioButtonGroup(labels=assembly_opts, active=1,
                                  width=menu_width, margin=menu_margins)
-gene_opts = sorted(refseq.name_chrom.unique())
+# Completions are sent as the user types, see complete_gene
 gene_menu = AutocompleteInput(title='Gene (refseq symbol)', value=gene,
-                              completions=gene_opts, width=menu_width,
+                              completions=[gene], width=menu_width,
                               min_characters=1, case_sensitive=False,
                               margin=menu_margins)
 
+# Only in the assembly shown, whose annotations are loaded already. Reading
+# the annotations of the other assembly would hold the annotation lock while
+# new sessions render their first page. Windows shown later also prefetch
+# the other assembly, see apply_window.
+prefetcher.prefetch_locus(data_path, screen_name, assembly, chrom, start, end,
+                          padd, screen_opts)
+
+
+def complete_gene(attr, old, new):
+    symbols = get_gene_symbols(data_path,
+                               assembly=assembly_opts[assembly_menu.active])
+    gene_menu.completions = symbols.complete(new)
+
 
 def load_gene(attr, old, new):
     txt_out.text = 'Loading gene...'
     curdoc().add_next_tick_callback(update_gene)
 
 
+def load_window(screen_name, assembly, chrom, start, end, gene=None,
+                trace=None):
+    # Runs in the loader threads, off the server event loop
+    with metrics.tracing(trace):
+        with metrics.span('prefetch_wait'):
+            prefetcher.claim(data_path, screen_name, assembly, chrom,
+                             start-padd, end+padd)
+        return {'screen_name': screen_name, 'assembly': assembly,
+                'chrom': chrom, 'start': start, 'end': end, 'gene': gene,
+                'trace': trace,
+                'refseq': get_gene_annotations(data_path,
+                                               assembly=assembly),
+                'density': overview_density(screen_name, assembly),
+                'stats': gene_stats_text(screen_name, assembly, gene),
+                'insertions': load_insertions(data_path, screen_name, chrom,
+                                              start-padd, end+padd,
+                                              assembly=assembly)}
+
+
+def submit_window(screen_name, assembly, chrom, start, end, message,
+                  gene=None):
+    # Load the window in the background and show it when it arrives, unless
+    # another window was requested in the meantime
+    trace = Trace('window', f'{screen_name} {assembly} '
+                            f'{chrom}:{start + 1:,}-{end:,}')
+    loader.submit(partial(load_window, screen_name, assembly, chrom, start,
+                          end, gene=gene, trace=trace),
+                  partial(show_window, message), show_error)
+
+
+def trace_text(trace):
+    # Stages of a window load (see tools.metrics)
+    rows = ''.join(f'<tr><td>{stage}</td><td>{value:,.0f}</td></tr>'
+                   for stage, value in trace.spans)
+
+    return f'<b>Last load</b> (ms, bytes)<table>{rows}</table>'
+
+
+def show_window(message, window):
+    # The stages of showing the window and the size of the document patch
+    # sent to the browser are added to the trace of the window
+    with metrics.tracing(window['trace']), metrics.patch_size(curdoc()):
+        apply_window(message, window)
+    metrics.finish(window['trace'])
+    if metrics_out.visible:
+        metrics_out.text = trace_text(window['trace'])
+
+
+def apply_window(message, window):
+    global refseq, insertions, chrom, start, end, gene
+    refseq = window['refseq']
+    insertions = window['insertions']
+    chrom = window['chrom']
+    start = window['start']
+    end = window['end']
+    gene = window['gene']
+
+    plots = plot_ins(insertions, window['screen_name'], chrom, start, end,
+                     refseq, assembly=window['assembly'])
+    show_plots(plots)
+    if (overview.screen, overview.assembly) != (window['screen_name'],
+                                                window['assembly']):
+        overview.update(window['density'], window['screen_name'],
+                        window['assembly'])
+    overview.show_window(chrom, start, end)
+    stats_out.text = window['stats']
+    txt_out.text = message
+
+    # Warm the cache for the screens, genes and assembly likely shown next
+    prefetcher.prefetch_locus(data_path, window['screen_name'],
+                              window['assembly'], chrom, start, end, padd,
+                              screen_opts, assemblies=assembly_opts,
+                              gene=window['gene'])
+
+
+def show_error(exception):
+    if not isinstance(exception, OSError):
+        raise exception
+    txt_out.text = 'No data found for these parameters.'
+
+
 def update_gene():
-    
-    gene = gene_menu.value
+
+    menu_gene = gene_menu.value
     screen_name = screen_menu.value
     assembly = assembly_opts[assembly_menu.active]
 
-    gene_pos = refseq.query('name_chrom == @gene')
-    global chrom
-    global start
-    global end
-    chrom = gene_pos.chrom.head(1).values[0]
-    start = gene_pos.txStart.min()
-    end = gene_pos.txEnd.max()
+    span = get_gene_symbols(data_path, assembly=assembly).lookup(menu_gene)
+    if span is None:
+        txt_out.text = f'Gene {menu_gene} not found in {assembly}.'
+        return
+    gene_chrom, gene_start, gene_end = span
 
-    insertions = load_insertions(data_path, screen_name, chrom, start-padd,
-                                 end+padd, assembly=assembly)
-    plots = plot_ins(insertions, screen_name, chrom, start, end, refseq,
-                     assembly=assembly)
-    layout.children[1] = plots
-    txt_out.text = 'Finished loading gene.'
+    submit_window(screen_name, assembly, gene_chrom, gene_start, gene_end,
+                  'Finished loading gene.', gene=menu_gene)
 
 
 def load_position(attr, old, new):
@@ -135,25 +343,16 @@ def load_position(attr, old, new):
 
 
 def update_position():
-    
+
     screen_name = screen_menu.value
     assembly = assembly_opts[assembly_menu.active]
     position = pos_input.value
 
     # Convert to 0-based left-closed right-open
-    global chrom
-    global start
-    global end
-    chrom = f'chr{position.split(":")[0][3:]}'
-    start = int(position.split(':')[1].split('-')[0].replace(',', '')) - 1
-    end = int(position.split(':')[1].split('-')[1].replace(',', ''))
+    pos_chrom, pos_start, pos_end = parse_region(position)
 
-    insertions = load_insertions(data_path, screen_name, chrom, start-padd,
-                                 end+padd, assembly=assembly)
-    plots = plot_ins(insertions, screen_name, chrom, start, end, refseq,
-                     assembly=assembly)
-    layout.children[1] = plots
-    txt_out.text = 'Finished loading position.'
+    submit_window(screen_name, assembly, pos_chrom, pos_start, pos_end,
+                  'Finished loading position.')
 
 
 def load_assembly(attr, old, new):
@@ -162,49 +361,38 @@ def load_assembly(attr, old, new):
 
 
 def update_refseq():
-    
+
     screen_name = screen_menu.value
     assembly = assembly_opts[assembly_menu.active]
 
-    global refseq
-    refseq = load_gene_annotations(data_path, assembly=assembly)
-    try:
-        plots = plot_ins(insertions, screen_name, chrom, start, end, refseq,
-                        assembly=assembly)
-        layout.children[1] = plots
-        txt_out.text = 'Finished loading assembly.'
-    except OSError:
-        txt_out.text = 'No data found for these parameters.'
+    submit_window(screen_name, assembly, chrom, start, end,
+                  'Finished loading assembly.', gene=gene)
 
 
 def load_screen(attr, old, new):
     txt_out.text = 'Loading screen...'
     curdoc().add_next_tick_callback(update_screen_ins)
 
+
 def update_screen_ins():
     screen_name = screen_menu.value
     assembly = assembly_opts[assembly_menu.active]
 
-    try:
-        global insertions
-        insertions = load_insertions(data_path, screen_name, chrom, start-padd,
-                                     end+padd, assembly=assembly)
-        plots = plot_ins(insertions, screen_name, chrom, start, end, refseq,
-                     assembly=assembly)
-        layout.children[1] = plots
-        txt_out.text = 'Finished loading screen.'
-    except OSError:
-        txt_out.text = 'No data found for these parameters.'
+    submit_window(screen_name, assembly, chrom, start, end,
+                  'Finished loading screen.', gene=gene)
 
 
 screen_menu.on_change('value', load_screen)
 assembly_menu.on_change('active', load_assembly)
 gene_menu.on_change('value', load_gene)
+gene_menu.on_change('value_input', complete_gene)
 pos_input.on_change('value', load_position)
 
-menus = column(screen_menu, assembly_menu, gene_menu, pos_input, txt_out)
+menus = column(screen_menu, assembly_menu, gene_menu, pos_input, txt_out,
+               stats_out, metrics_out)
 
-layout = row(menus, plots)
+main = column(overview.plt, plots)
+layout = row(menus, main)
 
 curdoc().add_root(layout)
 # st.bokeh_chart(layout, use_container_width=False)
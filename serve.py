@@ -0,0 +1,44 @@
+'''Runs the browser app with the data endpoints of tools.api in one Bokeh
+server, which bokeh serve cannot do for a single script app. Takes the
+bokeh serve options used in the Procfile, eg.:
+
+    python serve.py --port 5006 --allow-websocket-origin localhost:5006
+'''
+import argparse
+import os
+
+from bokeh.command.util import build_single_handler_application
+from bokeh.server.server import Server
+
+from tools.api import api_patterns
+from tools.load_data import DATA_PATH
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'insertion-browser.py')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the insertion browser and its data API.')
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--address', default=None)
+    parser.add_argument('--allow-websocket-origin', action='append',
+                        default=None)
+    parser.add_argument('--use-xheaders', action='store_true')
+    parser.add_argument('--num-procs', type=int, default=1)
+    args = parser.parse_args()
+
+    app = build_single_handler_application(APP_PATH)
+    server = Server({'/insertion-browser': app}, port=args.port,
+                    address=args.address,
+                    allow_websocket_origin=args.allow_websocket_origin,
+                    use_xheaders=args.use_xheaders,
+                    num_procs=args.num_procs,
+                    extra_patterns=api_patterns(DATA_PATH))
+    server.start()
+    print(f'Serving the insertion browser on port {args.port}')
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    main()
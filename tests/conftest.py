@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+CHROM_LENGTH = 1000000
+
+
+def write_insertions(path, n=20000, replicate=False, seed=0):
+    rng = np.random.default_rng(seed)
+    insertions = pd.DataFrame({'chr': 'chr1',
+                               'pos': np.sort(rng.integers(0, CHROM_LENGTH,
+                                                           n)),
+                               'strand': rng.choice(['+', '-'], n),
+                               'chan': rng.choice(['high', 'low'], n)})
+    if replicate:
+        insertions['replicate'] = rng.choice(['1', '2', '3', '4'], n)
+    insertions.to_parquet(path, row_group_size=5000)
+
+
+def write_refseq(path):
+    # Two genes on chr1 and one on chr2, which has no insertion file
+    genes = [('GENE1', 'chr1', '+', 100000, 150000),
+             ('GENE1', 'chr1', '+', 110000, 160000),
+             ('GENE2', 'chr1', '-', 500000, 520000),
+             ('GENE3', 'chr2', '+', 1000, 9000)]
+    rows = [dict(name=f'NM_{i}', chrom=chrom, strand=strand,
+                 txStart=start, txEnd=end, cdsStart=start + 100,
+                 cdsEnd=end - 100, exonCount=2,
+                 exonStarts=f'{start},{end - 1000},',
+                 exonEnds=f'{start + 1000},{end},', name2=gene,
+                 name_chrom=gene, known=True, coding=True)
+            for i, (gene, chrom, strand, start, end) in enumerate(genes)]
+    pd.DataFrame(rows).to_parquet(path)
+
+
+@pytest.fixture(scope='session')
+def data_path(tmp_path_factory):
+    '''Processed data with an 'ip' screen (screenA) and an 'sl' screen with
+    a replicate column (screenS), both with insertions on chr1 only.
+    '''
+    root = tmp_path_factory.mktemp('processed_data')
+    (root / 'refseq').mkdir()
+    write_refseq(root / 'refseq' / 'ncbi-genes-hg38.pq')
+    for screen, replicate in (('screenA', False), ('screenS', True)):
+        path = root / 'screen-insertions' / screen / 'hg38' / 'insertions.pq'
+        path.mkdir(parents=True)
+        write_insertions(path / 'chr1', replicate=replicate)
+
+    return str(root)
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+
+from tools.api import InsertionsHandler, api_patterns, frame_json
+
+
+def fetch(data_path, path, **kwargs):
+    async def request():
+        server = HTTPServer(Application(api_patterns(data_path)))
+        sock, port = bind_unused_port()
+        server.add_sockets([sock])
+        try:
+            return await AsyncHTTPClient().fetch(
+                f'http://127.0.0.1:{port}{path}', raise_error=False,
+                **kwargs)
+        finally:
+            server.stop()
+
+    return asyncio.run(request())
+
+
+def reject_constant(name):
+    raise ValueError(f'{name} is not valid JSON')
+
+
+def test_frame_json_missing_values():
+    frame = pd.DataFrame({'start': [1.0, np.nan],
+                          'name': pd.Categorical(['a', None])})
+    data = json.loads(frame_json(frame, 'chr1', 0, 10),
+                      parse_constant=reject_constant)
+
+    assert data['columns'] == {'start': [1.0, None], 'name': ['a', None]}
+
+
+def test_etag_before_load(data_path, monkeypatch):
+    calls = []
+
+    def load(self, chrom, start, end):
+        calls.append((chrom, start, end))
+        return pd.DataFrame({'pos': [100500], 'chan': ['high'],
+                             'strand': ['+']})
+
+    monkeypatch.setattr(InsertionsHandler, 'load', load)
+    path = '/api/insertions?screen=screenA&region=chr1:100001-200000'
+    response = fetch(data_path, path)
+    assert response.code == 200
+    assert json.loads(response.body)['columns']['pos'] == [100500]
+    assert calls == [('chr1', 100000, 200000)]
+    etag = response.headers['Etag']
+
+    # Revalidation does not load the window
+    response = fetch(data_path, path, headers={'If-None-Match': etag})
+    assert response.code == 304
+    assert len(calls) == 1
+
+    # Arrow responses have another ETag
+    response = fetch(data_path, path + '&format=arrow',
+                     headers={'If-None-Match': etag})
+    assert response.code == 200
+    assert len(calls) == 2
+
+
+def test_invalid_arguments(data_path):
+    for query, reason in (
+            ('screen=../../x&region=chr1:1-1000', 'Screen names'),
+            ('screen=screenA%2F..&region=chr1:1-1000', 'Screen names'),
+            ('screen=screenA&assembly=..&region=chr1:1-1000', 'Assembly'),
+            ('screen=screenA&region=../x:1-1000', 'Chromosome'),
+            ('screen=screenA&region=chr1:1000-1', 'end after its start'),
+            ('screen=screenA&region=chr1:1-20000000', 'at most')):
+        response = fetch(data_path, f'/api/insertions?{query}')
+        assert response.code == 400, query
+        assert reason in response.reason, query
+
+    response = fetch(data_path, '/api/exons?assembly=x/y&region=chr1:1-1000')
+    assert response.code == 400
+
+
+def test_missing_files(data_path):
+    # Exon regions are computed from the transcripts without their file
+    response = fetch(data_path, '/api/exons?region=chr1:100001-200000')
+    assert response.code == 200
+    assert set(json.loads(response.body)['columns']['name2']) == {'GENE1'}
+
+    response = fetch(data_path, '/api/insertions?screen=screenA&'
+                     'region=chr2:1-200000')
+    assert response.code == 404
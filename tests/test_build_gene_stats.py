@@ -0,0 +1,21 @@
+import shutil
+
+import pandas as pd
+
+from tools.build_gene_stats import STAT_COLUMNS, write_gene_stats
+
+
+def test_genes_without_insertion_file(data_path, tmp_path):
+    # Written to a copy, as the other tests share data_path
+    data_path = shutil.copytree(data_path, tmp_path / 'processed_data')
+    stats = write_gene_stats(str(data_path), 'screenA', max_workers=1)
+
+    assert list(stats['name_chrom']) == ['GENE1', 'GENE2', 'GENE3']
+    stats = stats.set_index('name_chrom')
+    assert (stats.loc['GENE3', STAT_COLUMNS] == 0).all()
+    assert stats.loc['GENE1', STAT_COLUMNS].sum() > 0
+
+    written = pd.read_parquet(data_path / 'screen-gene-stats' / 'screenA'
+                              / 'gene-stats-hg38.pq')
+    assert len(written) == 3
+    assert (written[STAT_COLUMNS].dtypes == 'int32').all()
@@ -0,0 +1,72 @@
+import os
+import time
+
+import fsspec
+
+from tools.load_data import DiskCache
+
+
+def write(url, data):
+    with fsspec.open(url, 'wb') as f:
+        f.write(data)
+
+
+def test_hit_and_miss(tmp_path):
+    write('memory://bucket/hit/a.pq', b'a' * 100)
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=2**20)
+
+    path = cache.path('memory://bucket/hit/a.pq')
+    with open(path, 'rb') as f:
+        assert f.read() == b'a' * 100
+    assert cache.path('memory://bucket/hit/a.pq') == path
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_version_check(tmp_path, monkeypatch):
+    write('memory://bucket/version/a.pq', b'a' * 100)
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=2**20,
+                      check_interval=300)
+    path = cache.path('memory://bucket/version/a.pq')
+
+    # Reads within check_interval do not ask the bucket
+    with monkeypatch.context() as m:
+        m.setattr(type(fsspec.filesystem('memory')), 'info',
+                  lambda *args, **kwargs: 1 / 0)
+        assert cache.path('memory://bucket/version/a.pq') == path
+
+    # An updated file is downloaded again once checked
+    write('memory://bucket/version/a.pq', b'b' * 200)
+    cache.check_interval = 0
+    new_path = cache.path('memory://bucket/version/a.pq')
+    assert new_path != path
+    with open(new_path, 'rb') as f:
+        assert f.read() == b'b' * 200
+    assert cache.stats() == {'hits': 1, 'misses': 2}
+
+
+def test_evict(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=250, min_age=60)
+    paths = []
+    for name in 'abc':
+        write(f'memory://bucket/evict/{name}.pq', name.encode() * 100)
+        paths.append(cache.path(f'memory://bucket/evict/{name}.pq'))
+
+    # Files read in the last min_age seconds are kept
+    assert all(os.path.exists(path) for path in paths)
+
+    # The least recently read file is deleted
+    now = time.time()
+    for path, age in zip(paths, (180, 120, 0)):
+        os.utime(path, (now - age, now - age))
+    cache.evict()
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1]) and os.path.exists(paths[2])
+
+
+def test_directory(tmp_path):
+    write('memory://bucket/dir/data.pq/chr1', b'a')
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=2**20)
+
+    assert (cache.path('memory://bucket/dir/data.pq')
+            == 'memory://bucket/dir/data.pq')
+    assert os.listdir(tmp_path / 'cache') == []
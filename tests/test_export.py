@@ -0,0 +1,23 @@
+import os
+
+from tools.export import export_genes
+
+
+def test_genes_without_insertions(data_path, tmp_path, capsys):
+    # GENE3 is on chr2, which has no insertion file
+    paths = export_genes(data_path, ['GENE1', 'GENE2', 'GENE3'],
+                         ['screenA'], str(tmp_path), max_workers=1)
+
+    assert sorted(os.path.basename(path) for path in paths) == [
+        'screenA-hg38-GENE1.html', 'screenA-hg38-GENE2.html']
+    assert all(os.path.getsize(path) > 0 for path in paths)
+    assert ('1 plots skipped, no insertions on their chromosome: '
+            'screenA-hg38-GENE3') in capsys.readouterr().err
+
+
+def test_sl_screen(data_path, tmp_path):
+    paths = export_genes(data_path, ['GENE1'], ['screenS'], str(tmp_path),
+                         screen_type='sl', max_workers=1)
+
+    with open(paths[0]) as f:
+        assert 'replicate 1 +' in f.read()
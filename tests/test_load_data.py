@@ -0,0 +1,56 @@
+from tools import load_data
+from tools.load_data import InsertionCache, last_insertion, load_insertions
+from tools.plotting.insertions import InsertionPlot, encode_insertions
+
+
+def test_sl_screen_default_columns(data_path, monkeypatch):
+    monkeypatch.setattr(load_data, 'insertion_cache', InsertionCache(2**26))
+
+    for cache in (False, True, True):
+        insertions = load_insertions(data_path, 'screenS', 'chr1', 0, 200000,
+                                     cache=cache)
+        assert 'replicate' in insertions.columns
+        encoded = encode_insertions(insertions, screen_type='sl')
+        assert len(encoded) == len(insertions) > 0
+
+    InsertionPlot(insertions, 'screenS', 'hg38', 'chr1', 100000, 150000,
+                  screen_type='sl')
+
+
+def test_screen_without_replicate(data_path, monkeypatch):
+    # Files without optional columns are read with the default ones
+    monkeypatch.setattr(load_data, 'insertion_cache', InsertionCache(2**26))
+
+    for cache in (False, True, True):
+        insertions = load_insertions(data_path, 'screenA', 'chr1', 0, 200000,
+                                     cache=cache)
+        assert list(insertions.columns) == ['pos', 'chan', 'strand']
+        encoded = encode_insertions(insertions, screen_type='ip')
+        assert len(encoded) == len(insertions) > 0
+
+    InsertionPlot(insertions, 'screenA', 'hg38', 'chr1', 100000, 150000,
+                  screen_type='ip')
+
+
+def test_cache_hit_needs_columns(data_path, monkeypatch):
+    cache = InsertionCache(2**26)
+    monkeypatch.setattr(load_data, 'insertion_cache', cache)
+
+    load_insertions(data_path, 'screenS', 'chr1', 0, 200000,
+                    columns=['pos', 'chan', 'strand'])
+    insertions = load_insertions(data_path, 'screenS', 'chr1', 1000, 2000)
+    assert 'replicate' in insertions.columns
+    assert cache.stats()['hits'] == 0
+
+    insertions = load_insertions(data_path, 'screenS', 'chr1', 1000, 2000,
+                                 columns=['pos'])
+    assert list(insertions.columns) == ['pos']
+    assert cache.stats()['hits'] == 1
+
+
+def test_last_insertion(data_path):
+    insertions = load_insertions(data_path, 'screenA', 'chr1', 0,
+                                 10**9, cache=False)
+
+    assert (last_insertion(data_path, 'screenA', 'hg38', 'chr1')
+            == insertions['pos'].max())
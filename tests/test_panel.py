@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+from tools.panel import (gene_windows, merge_windows, query_panel,
+                         read_panel_chrom, write_panel)
+
+
+def test_merge_windows():
+    windows = pd.DataFrame({'start': [500, 0, 50, 200, 301, 1000],
+                            'end': [600, 100, 150, 300, 400, 1000]})
+    merged = merge_windows(windows)
+
+    # Overlapping windows are merged, touching ones too as ends are
+    # inclusive, adjacent ones are kept apart
+    assert merged.values.tolist() == [[0, 150], [200, 300], [301, 400],
+                                      [500, 600], [1000, 1000]]
+    assert merge_windows(windows.iloc[:0]).empty
+
+
+def test_gene_windows_missing(data_path):
+    windows, missing = gene_windows(data_path, ['GENE2', 'NOPE', 'GENE1',
+                                                'GENE1'], padd=1000)
+
+    assert windows.values.tolist() == [['GENE1', 'chr1', 99000, 161000],
+                                       ['GENE2', 'chr1', 499000, 521000]]
+    assert missing == ['NOPE']
+
+
+def test_read_panel_chrom(data_path):
+    # GENE1 and GENE2 windows overlap with this padd, and are read as one
+    windows, _ = gene_windows(data_path, ['GENE1', 'GENE2'], padd=200000)
+    assert len(merge_windows(windows)) == 1
+    panel = read_panel_chrom(data_path, 'screenS', 'hg38', 'chr1', windows)
+
+    insertions = pd.read_parquet(
+        f'{data_path}/screen-insertions/screenS/hg38/insertions.pq/chr1')
+    for gene, chrom, start, end in windows.itertuples(index=False):
+        expected = insertions[(insertions['pos'] >= start)
+                              & (insertions['pos'] <= end)]
+        gene_panel = panel[panel['gene'] == gene]
+        assert (gene_panel['chrom'] == chrom).all()
+        assert gene_panel['pos'].tolist() == expected['pos'].tolist()
+        assert (gene_panel['replicate'].astype(str).tolist()
+                == expected['replicate'].tolist())
+
+
+@pytest.mark.parametrize('name', ['panel.pq', 'panel.arrow'])
+def test_query_panel(data_path, tmp_path, capsys, name):
+    panel = query_panel(data_path, ['GENE1', 'GENE3', 'NOPE'],
+                        ['screenA', 'screenS'], max_workers=1)
+
+    err = capsys.readouterr().err
+    assert '1 genes not found in hg38: NOPE' in err
+    assert ('2 gene windows skipped, no insertions on their chromosome: '
+            'screenA-hg38-GENE3, screenS-hg38-GENE3') in err
+
+    assert list(panel.columns) == ['screen', 'assembly', 'gene', 'chrom',
+                                   'pos', 'chan', 'strand', 'replicate']
+    assert set(panel['gene']) == {'GENE1'}
+    assert panel.loc[panel['screen'] == 'screenA', 'replicate'].isna().all()
+    assert panel.loc[panel['screen'] == 'screenS', 'replicate'].notna().all()
+
+    write_panel(panel, str(tmp_path / name))
+    if name.endswith('.arrow'):
+        written = pd.read_feather(tmp_path / name)
+    else:
+        written = pd.read_parquet(tmp_path / name)
+    pd.testing.assert_frame_equal(written, panel)
+    for col in ('screen', 'assembly', 'gene', 'chrom', 'chan', 'strand',
+                'replicate'):
+        assert written[col].dtype == 'category'
@@ -0,0 +1,22 @@
+from tools import load_data
+from tools.load_data import InsertionCache
+from tools.prefetch import Prefetcher
+
+
+def test_prefetched_window_counts_once(data_path, monkeypatch):
+    cache = InsertionCache(2**26)
+    monkeypatch.setattr(load_data, 'insertion_cache', cache)
+    prefetcher = Prefetcher(max_workers=1, max_bytes=2**26, cache=cache)
+
+    assert prefetcher.submit(data_path, 'screenA', 'hg38', 'chr1', 0,
+                             300000)
+    for _ in range(2):
+        # Waits for the prefetch on the first load
+        prefetcher.claim(data_path, 'screenA', 'hg38', 'chr1', 100000,
+                         200000)
+        load_data.load_insertions(data_path, 'screenA', 'chr1', 100000,
+                                  200000)
+
+    stats = prefetcher.stats()
+    assert stats['loads'] == 2
+    assert stats['hits'] == 1
@@ -0,0 +1,140 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.bench_exon_regions import (get_exon_regions_per_base,
+                                           make_refseq)
+from tools.refseq import (collapse_gene_refseq, collapse_refseq,
+                          get_exon_regions)
+
+
+def transcript(name, gene, strand, exons, cds, chrom='chr1',
+               name_chrom=None):
+    # Refseq row of a transcript with exons [(start, end), ...] and cds
+    # (start, end), equal for non-coding transcripts
+    return {'name': name, 'chrom': chrom, 'strand': strand,
+            'txStart': exons[0][0], 'txEnd': max(e for _, e in exons),
+            'cdsStart': cds[0], 'cdsEnd': cds[1], 'exonCount': len(exons),
+            'exonStarts': ''.join(f'{s},' for s, _ in exons),
+            'exonEnds': ''.join(f'{e},' for _, e in exons),
+            'name2': gene, 'cdsStartStat': 'cmpl', 'cdsEndStat': 'cmpl',
+            'name_chrom': name_chrom or gene}
+
+
+@pytest.fixture
+def refseq():
+    return pd.DataFrame([
+        # Cds starting and ending inside exons, and an exon of utr only
+        transcript('NM_1', 'GENE1', '+',
+                   [(100, 200), (300, 400), (500, 600), (700, 800)],
+                   (150, 550)),
+        # Exons overlapping those of NM_1 and each other, cds limits at exon
+        # limits
+        transcript('NM_2', 'GENE1', '+', [(120, 220), (200, 380), (500, 650)],
+                   (200, 650)),
+        # Non-coding
+        transcript('NR_3', 'GENE1', '+', [(100, 250), (300, 420)],
+                   (420, 420)),
+        # Minus strand, cds within a single exon
+        transcript('NM_4', 'GENE2', '-', [(1000, 1500), (2000, 2100)],
+                   (1100, 1200)),
+        # Cds of one base, on another chromosome
+        transcript('NM_5', 'GENE3', '+', [(10, 20), (30, 40)], (35, 36),
+                   chrom='chr2'),
+    ])
+
+
+def test_exon_regions_per_gene(refseq):
+    for _, gene_refseq in refseq.groupby('name_chrom'):
+        pd.testing.assert_frame_equal(get_exon_regions(gene_refseq),
+                                      get_exon_regions_per_base(gene_refseq))
+
+
+def test_exon_regions_by_gene(refseq):
+    # Shuffled, as get_exon_regions sorts by group
+    refseq = refseq.sample(frac=1, random_state=0)
+    expected = (refseq.groupby('name_chrom')
+                .apply(get_exon_regions_per_base).reset_index(drop=True))
+
+    pd.testing.assert_frame_equal(get_exon_regions(refseq, by='name_chrom'),
+                                  expected)
+
+
+def test_exon_regions_synthetic():
+    refseq = make_refseq(genes=5)
+    expected = (refseq.groupby('name_chrom')
+                .apply(get_exon_regions_per_base).reset_index(drop=True))
+
+    pd.testing.assert_frame_equal(get_exon_regions(refseq, by='name_chrom'),
+                                  expected)
+
+
+@pytest.fixture
+def genes():
+    return pd.DataFrame([
+        # Longest cds tied between NM_11 and NM_12, NM_12 starts first
+        transcript('NM_10', 'GENE1', '+', [(100, 200), (300, 400)],
+                   (150, 350)),
+        transcript('NM_11', 'GENE1', '+', [(90, 200), (300, 500)],
+                   (150, 450)),
+        transcript('NM_12', 'GENE1', '+', [(50, 200), (300, 500)],
+                   (140, 440)),
+        transcript('NR_13', 'GENE1', '+', [(10, 600)], (600, 600)),
+        # Minus strand, tied cds where the last cdsEnd is upstream
+        transcript('NM_20', 'GENE2', '-', [(1000, 1200), (1500, 1800)],
+                   (1100, 1600)),
+        transcript('NM_21', 'GENE2', '-', [(1000, 1200), (1500, 1900)],
+                   (1150, 1650)),
+        transcript('NR_22', 'GENE2', '-', [(900, 2000)], (2000, 2000)),
+        # A gene on two chromosomes, with a transcript name on both
+        transcript('NM_30', 'GENE3', '+', [(5000, 5400)], (5100, 5300),
+                   chrom='chrX'),
+        transcript('NM_31', 'GENE3', '+', [(4000, 5600)], (4100, 4200),
+                   chrom='chrX'),
+        transcript('NM_30', 'GENE3', '+', [(7000, 7400)], (7100, 7300),
+                   chrom='chrY', name_chrom='GENE3_chrY'),
+        # Only non-coding transcripts
+        transcript('NR_40', 'GENE4', '-', [(100, 300), (400, 500)],
+                   (500, 500), chrom='chr2'),
+    ]).sample(frac=1, random_state=0)
+
+
+def collapse_per_gene(refseq, outer_cds, mode):
+    # collapse_gene_refseq prints genes whose longest cds does not start
+    # first
+    with contextlib.redirect_stdout(io.StringIO()):
+        return refseq.groupby('name_chrom').apply(
+            collapse_gene_refseq, outer_cds=outer_cds, mode=mode)
+
+
+@pytest.mark.parametrize('outer_cds', [True, False])
+def test_collapse_first_last(genes, outer_cds):
+    collapsed = collapse_refseq(genes, outer_cds=outer_cds)
+    pd.testing.assert_frame_equal(
+        collapsed, collapse_per_gene(genes, outer_cds, 'first-last'),
+        check_dtype=False)
+
+    assert list(collapsed.index) == ['GENE1', 'GENE2', 'GENE3', 'GENE3_chrY',
+                                     'GENE4']
+    assert tuple(collapsed.loc['GENE2', ['txStart', 'txEnd']]) == (900, 2000)
+    if outer_cds:
+        assert tuple(collapsed.loc['GENE1', ['cdsStart', 'cdsEnd']]) == (
+            140, 600)
+    else:
+        assert tuple(collapsed.loc['GENE1', ['cdsStart', 'cdsEnd']]) == (
+            600, 350)
+
+
+def test_collapse_longest_cds(genes):
+    collapsed = collapse_refseq(genes, mode='longest-cds')
+    pd.testing.assert_frame_equal(
+        collapsed, collapse_per_gene(genes, True, 'longest-cds'),
+        check_dtype=False)
+
+    names = collapsed['name'].droplevel('gene').to_dict()
+    assert names == {'GENE1': 'NM_12', 'GENE2': 'NM_21', 'GENE3': 'NM_30',
+                     'GENE3_chrY': 'NM_30', 'GENE4': 'NR_40'}
+    assert collapsed.loc[('GENE3', 'GENE3'), 'chrom'] == 'chrX'
+    assert collapsed.loc[('GENE3_chrY', 'GENE3'), 'chrom'] == 'chrY'
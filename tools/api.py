@@ -0,0 +1,222 @@
+'''HTTP endpoints serving the data of the browser windows to other tools,
+without a Bokeh session. Run next to the app by serve.py:
+
+    GET /api/insertions?screen=screenA&region=chr9:5000001-5100000
+    GET /api/transcripts?assembly=hg38&region=chr9:5000001-5100000
+    GET /api/exons?assembly=hg38&region=chr9:5000001-5100000
+    GET /metrics
+
+Regions are 1-based as in the position menu. Screen, assembly and
+chromosome names are checked before any file path is built from them.
+Responses are column-oriented JSON, eg.:
+
+    {"chrom":"chr9","start":5000000,"end":5100000,
+     "columns":{"pos":[5000012,...],"chan":["high",...],...}}
+
+or an Arrow IPC stream with format=arrow (or an Accept header asking for
+application/vnd.apache.arrow.stream). Missing values are null in JSON.
+Insertions are read through the insertion cache of the server process and
+loads run in the loader threads. Responses have an ETag derived from the
+query and the version (see tools.load_data.file_version) of the files read,
+so clients sending If-None-Match get a 304 without loading the window.
+/metrics returns the percentiles of the stages timed by tools.metrics and the
+last traced window loads as JSON.
+'''
+import hashlib
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from functools import partial
+
+import fsspec
+import pandas as pd
+import pyarrow as pa
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError, RequestHandler
+
+from tools.load_data import (file_version, get_gene_index, insertions_url,
+                             load_insertions, parse_region)
+from tools.loader import executor
+from tools.metrics import metrics
+from tools.plotting.transcripts import window_exons
+
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+# Seconds clients may reuse a response before revalidating it
+MAX_AGE = int(os.environ.get('API_MAX_AGE', 3600))
+# Widest region (bp) served, as wider windows are better read with
+# tools.panel
+MAX_REGION = int(os.environ.get('API_MAX_REGION', 10000000))
+# Names allowed in the query arguments that make up data file paths
+ASSEMBLIES = ('hg19', 'hg38')
+SCREEN_NAME = re.compile(r'[A-Za-z0-9_-]+')
+CHROM_NAME = re.compile(r'chr[0-9XYM]+')
+
+
+def frame_json(frame: pd.DataFrame, chrom: str, start: int,
+               end: int) -> str:
+    # NaN is not valid JSON
+    if frame.isna().any(axis=None):
+        frame = frame.astype(object).where(frame.notna(), None)
+    columns = {col: frame[col].tolist() for col in frame.columns}
+
+    return json.dumps({'chrom': chrom, 'start': start, 'end': end,
+                       'columns': columns}, separators=(',', ':'))
+
+
+def frame_arrow(frame: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def files_etag(urls: list, query: str) -> str:
+    # ETag of the responses to query reading the files at urls. Missing
+    # files (eg. optional exon regions) have no version.
+    versions = []
+    for url in urls:
+        fs, fs_path = fsspec.core.url_to_fs(url)
+        try:
+            versions.append(file_version(fs.info(fs_path)))
+        except FileNotFoundError:
+            versions.append(None)
+
+    return hashlib.sha1(f'{query} {versions}'.encode()).hexdigest()
+
+
+class WindowHandler(RequestHandler, ABC):
+    # Base of the handlers returning a dataframe for a region, given by
+    # load(chrom, start, end) from the files of urls(chrom), timed as stage
+    stage = 'api'
+
+    def initialize(self, data_path: str) -> None:
+        self.data_path = data_path
+
+    def prepare(self) -> None:
+        self.assembly = self.get_argument('assembly', 'hg38')
+        if self.assembly not in ASSEMBLIES:
+            raise HTTPError(400, reason=f'Assembly must be one of '
+                            f'{", ".join(ASSEMBLIES)}')
+
+    @abstractmethod
+    def urls(self, chrom: str) -> list:
+        pass
+
+    @abstractmethod
+    def load(self, chrom: str, start: int, end: int) -> pd.DataFrame:
+        pass
+
+    async def get(self) -> None:
+        try:
+            chrom, start, end = parse_region(self.get_argument('region'))
+        except ValueError:
+            raise HTTPError(400, reason='Region must be like '
+                            'chr9:5,000,001-5,100,000')
+        if not CHROM_NAME.fullmatch(chrom):
+            raise HTTPError(400, reason='Chromosome must be like chr9, chrX '
+                            'or chrM')
+        if not 0 <= start < end:
+            raise HTTPError(400, reason='Region must end after its start')
+        if end - start > MAX_REGION:
+            raise HTTPError(400, reason=f'Region must be at most '
+                            f'{MAX_REGION:,} bp')
+
+        arrow = (self.get_argument('format', None) == 'arrow'
+                 or ARROW_TYPE in self.request.headers.get('Accept', ''))
+        loop = IOLoop.current()
+        etag = await loop.run_in_executor(executor, files_etag,
+                                          self.urls(chrom),
+                                          f'{self.request.uri} {arrow}')
+
+        self.set_header('Cache-Control', f'max-age={MAX_AGE}')
+        self.set_header('Vary', 'Accept')
+        self.set_header('Etag', f'"{etag}"')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        try:
+            with metrics.span(self.stage):
+                frame = await loop.run_in_executor(
+                    executor, partial(self.load, chrom, start, end))
+        except OSError:
+            raise HTTPError(404, reason='No data found for these '
+                            'parameters')
+
+        if arrow:
+            self.set_header('Content-Type', ARROW_TYPE)
+            self.write(frame_arrow(frame))
+        else:
+            self.set_header('Content-Type', 'application/json')
+            self.write(frame_json(frame, chrom, start, end))
+
+
+class InsertionsHandler(WindowHandler):
+    stage = 'api_insertions'
+
+    def prepare(self):
+        super().prepare()
+        self.screen_name = self.get_argument('screen')
+        if not SCREEN_NAME.fullmatch(self.screen_name):
+            raise HTTPError(400, reason='Screen names have only letters, '
+                            'digits, _ and -')
+
+    def urls(self, chrom):
+        return [insertions_url(self.data_path, self.screen_name,
+                               self.assembly, chrom)]
+
+    def load(self, chrom, start, end):
+        # Columns default to the ones of the file, see load_insertions
+        columns = self.get_argument('columns', None)
+        return load_insertions(self.data_path, self.screen_name, chrom, start,
+                               end, assembly=self.assembly,
+                               columns=columns.split(',') if columns else None)
+
+
+class TranscriptsHandler(WindowHandler):
+    stage = 'api_transcripts'
+
+    def urls(self, chrom):
+        return [f'{self.data_path}/refseq/ncbi-genes-{self.assembly}.pq']
+
+    def load(self, chrom, start, end):
+        gene_index = get_gene_index(self.data_path, assembly=self.assembly)
+        return gene_index.transcripts(chrom, start, end)
+
+
+class ExonsHandler(WindowHandler):
+    stage = 'api_exons'
+
+    def urls(self, chrom):
+        return [f'{self.data_path}/refseq/ncbi-genes-{self.assembly}.pq',
+                f'{self.data_path}/refseq/exon-regions-{self.assembly}.pq/'
+                f'{chrom}']
+
+    def load(self, chrom, start, end):
+        transcripts = get_gene_index(self.data_path,
+                                     assembly=self.assembly).transcripts(
+                                         chrom, start, end)
+        exons = window_exons(transcripts, chrom, self.assembly,
+                             data_path=self.data_path)
+
+        return exons[['name2', 'name', 'reg_type', 'start', 'end']]
+
+
+class MetricsHandler(RequestHandler):
+
+    def get(self) -> None:
+        self.set_header('Cache-Control', 'no-store')
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(metrics.summary(), separators=(',', ':')))
+
+
+def api_patterns(data_path: str) -> list:
+    # Routes for the extra_patterns of a Bokeh server
+    return [(f'/api/{name}', handler, {'data_path': data_path})
+            for name, handler in (('insertions', InsertionsHandler),
+                                  ('transcripts', TranscriptsHandler),
+                                  ('exons', ExonsHandler))] + [
+        ('/metrics', MetricsHandler)]
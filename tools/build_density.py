@@ -0,0 +1,100 @@
+'''Writes insertion counts per channel and strand in bins of several sizes
+for every chromosome of the screens in screen-insertions:
+
+    {data_path}/screen-density/{screen}/{assembly}/density-{bin}.pq/{chrom}
+
+for bin sizes {bin} of 100 bp to 1 Mb. Each file has the start of the
+non-empty bins and one count column per channel and strand, eg. for 1 kb
+bins:
+start       high+   high-   low+    low-
+5021000     12      3       0       1
+
+The 1 Mb bins of all chromosomes are also written to a single file, with a
+chrom column, for the genome overview:
+
+    {data_path}/screen-density/{screen}/{assembly}/genome-density.pq
+
+tools.load_data.load_density reads the resolution fitting a range and a
+plot width, so zoomed out views do not read raw insertions. Run after
+adding or updating screens, eg.:
+
+    python -m tools.build_density processed_data --screens screenA
+'''
+import argparse
+
+import fsspec
+import numpy as np
+import pandas as pd
+
+from tools.build_insertions import insertions_path, list_chroms
+from tools.load_data import DENSITY_BIN_SIZES, GENOME_BIN_SIZE
+
+ROW_GROUP_SIZE = 50000
+
+
+def bin_counts(insertions: pd.DataFrame, bin_size: int) -> pd.DataFrame:
+    # Insertions per bin of bin_size bp, channel and strand
+    counts = (insertions
+              .groupby([insertions['pos'].values // bin_size * bin_size,
+                        'chan', 'strand'], observed=True)
+              .size()
+              .unstack(['chan', 'strand'], fill_value=0))
+    counts.columns = [f'{chan}{strand}' for chan, strand in counts.columns]
+    counts.index.name = 'start'
+
+    return (counts.sort_index(axis=1).astype(np.int32)
+            .reset_index().astype({'start': np.int32}))
+
+
+def write_density(data_path: str, screen_name: str,
+                  assembly: str = 'hg38',
+                  bin_sizes: list = DENSITY_BIN_SIZES) -> None:
+
+    in_path = insertions_path(data_path, screen_name, assembly)
+    out_path = f'{data_path}/screen-density/{screen_name}/{assembly}'
+    fs, fs_path = fsspec.core.url_to_fs(out_path)
+
+    for bin_size in bin_sizes:
+        fs.makedirs(f'{fs_path}/density-{bin_size}.pq', exist_ok=True)
+
+    genome = []
+    for chrom in list_chroms(data_path, screen_name, assembly):
+        print(f'Writing densities of {screen_name} {assembly} {chrom}...')
+        insertions = pd.read_parquet(f'{in_path}/{chrom}',
+                                     columns=['pos', 'chan', 'strand'])
+
+        for bin_size in bin_sizes:
+            bin_counts(insertions, bin_size).to_parquet(
+                f'{out_path}/density-{bin_size}.pq/{chrom}', index=False,
+                row_group_size=ROW_GROUP_SIZE)
+
+        genome.append(bin_counts(insertions, GENOME_BIN_SIZE)
+                      .assign(chrom=chrom))
+
+    if genome:
+        genome = pd.concat(genome, ignore_index=True).fillna(0)
+        count_cols = [c for c in genome.columns if c not in ('chrom',
+                                                             'start')]
+        genome = genome[['chrom', 'start'] + count_cols].astype(
+            {c: np.int32 for c in count_cols})
+        genome.to_parquet(f'{out_path}/genome-density.pq', index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write binned insertion counts of screens.')
+    parser.add_argument('data_path')
+    parser.add_argument('--screens', nargs='+', required=True)
+    parser.add_argument('--assembly', nargs='+', default=['hg19', 'hg38'])
+    parser.add_argument('--bin-sizes', type=int, nargs='+',
+                        default=DENSITY_BIN_SIZES)
+    args = parser.parse_args()
+
+    for screen_name in args.screens:
+        for assembly in args.assembly:
+            write_density(args.data_path, screen_name, assembly=assembly,
+                          bin_sizes=args.bin_sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''Writes the exon regions (cds and utr parts of every exon, see
+tools.refseq.get_exon_regions) of the refseq annotations of an assembly as
+one parquet file per chromosome, sorted by position:
+
+    {data_path}/refseq/exon-regions-{assembly}.pq/{chrom}
+
+TranscriptPlot reads the regions of the transcripts it shows from these
+files instead of parsing exonStarts and exonEnds. Run after updating the
+refseq files, eg.:
+
+    python -m tools.build_exon_regions processed_data --assembly hg38
+'''
+import argparse
+
+import fsspec
+import pandas as pd
+
+from tools.load_data import load_gene_annotations
+from tools.refseq import get_exon_regions
+
+# Small row groups, so that reading a window skips most of a chromosome
+ROW_GROUP_SIZE = 5000
+
+
+def build_exon_regions(chrom_refseq: pd.DataFrame) -> pd.DataFrame:
+    '''Returns the exon regions of the refseq transcripts of a chromosome,
+    with transcripts numbered (tx) within each gene, sorted by start. Eg.:
+    name2   name            tx  reg_type    start       end
+    JAK2    NM_004972.3     6   exUtr       4985032     4985244
+    JAK2    NM_004972.3     6   exCds       4985244     4985283
+    '''
+    regions = get_exon_regions(chrom_refseq, by='name_chrom')
+
+    regions = pd.DataFrame({
+        'name2': regions['name2'].values,
+        'name': regions['name'].values,
+        'tx': regions['tx_id'].values.astype('int32'),
+        'reg_type': regions['reg_type'].values,
+        'start': regions['reg_lims'].str[0].values.astype('int64'),
+        'end': regions['reg_lims'].str[1].values.astype('int64')})
+
+    return regions.sort_values(['start', 'end'], kind='stable',
+                               ignore_index=True)
+
+
+def write_exon_regions(data_path: str, assembly: str = 'hg38') -> None:
+
+    refseq = load_gene_annotations(data_path, assembly=assembly)
+
+    out_path = f'{data_path}/refseq/exon-regions-{assembly}.pq'
+    fs, fs_path = fsspec.core.url_to_fs(out_path)
+    fs.makedirs(fs_path, exist_ok=True)
+
+    for chrom, chrom_refseq in refseq.groupby('chrom'):
+        print(f'Writing exon regions of {assembly} {chrom}...')
+        regions = build_exon_regions(chrom_refseq)
+        regions.to_parquet(f'{out_path}/{chrom}', index=False,
+                           row_group_size=ROW_GROUP_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write exon region tables of refseq annotations.')
+    parser.add_argument('data_path')
+    parser.add_argument('--assembly', nargs='+', default=['hg19', 'hg38'])
+    args = parser.parse_args()
+
+    for assembly in args.assembly:
+        write_exon_regions(args.data_path, assembly=assembly)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+'''Writes the insertion counts of every gene of a screen per channel and
+orientation relative to the gene:
+
+    {data_path}/screen-gene-stats/{screen}/gene-stats-{assembly}.pq
+
+Genes are the refseq transcripts collapsed to their first txStart and last
+txEnd (collapse_refseq) and counts include insertions with
+txStart <= pos < txEnd. Genes of chromosomes without an insertion file have
+zero counts. Eg.:
+name_chrom  gene    chrom   txStart     txEnd       strand  high_sense ...
+JAK2        JAK2    chr9    4985032     5128183     +       211        ...
+
+Chromosomes are counted in parallel processes, eg.:
+
+    python -m tools.build_gene_stats processed_data --screens screenA
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import fsspec
+import numpy as np
+import pandas as pd
+
+from tools.build_insertions import insertions_path, list_chroms
+from tools.load_data import load_gene_annotations
+from tools.refseq import collapse_refseq
+
+STAT_COLUMNS = ['high_sense', 'high_antisense', 'low_sense',
+                'low_antisense']
+
+
+def collapse_genes(refseq: pd.DataFrame) -> pd.DataFrame:
+    # One span per name_chrom, sorted by chromosome and start
+    genes = collapse_refseq(refseq, by='name_chrom')
+
+    return (genes.reset_index()
+            .sort_values(['chrom', 'txStart'], kind='stable',
+                         ignore_index=True))
+
+
+def count_gene_insertions(genes: pd.DataFrame,
+                          insertions: pd.DataFrame) -> pd.DataFrame:
+    '''Counts of insertions per channel and orientation for genes of one
+    chromosome. Insertions are sorted once and counted with cumulative sums
+    over the sorted positions, so each gene costs two binary searches.
+    '''
+    insertions = insertions.sort_values('pos', kind='stable')
+    pos = insertions['pos'].values
+    lo = np.searchsorted(pos, genes['txStart'].values, side='left')
+    hi = np.searchsorted(pos, genes['txEnd'].values, side='left')
+
+    chan = insertions['chan'].astype(str).str[0].values
+    strand = insertions['strand'].astype(str).values
+    gene_plus = (genes['strand'] == '+').values
+
+    counts = {}
+    for ins_chan in ('h', 'l'):
+        for ins_strand in ('+', '-'):
+            in_group = (chan == ins_chan) & (strand == ins_strand)
+            cumsum = np.concatenate([[0], np.cumsum(in_group)])
+            counts[ins_chan, ins_strand] = cumsum[hi] - cumsum[lo]
+
+    stats = genes.copy()
+    for ins_chan, name in (('h', 'high'), ('l', 'low')):
+        plus, minus = counts[ins_chan, '+'], counts[ins_chan, '-']
+        stats[f'{name}_sense'] = np.where(gene_plus, plus, minus)
+        stats[f'{name}_antisense'] = np.where(gene_plus, minus, plus)
+
+    return stats
+
+
+def chrom_gene_stats(data_path: str, screen_name: str, assembly: str,
+                     chrom: str, genes: pd.DataFrame) -> pd.DataFrame:
+    # Runs in the worker processes
+    insertions = pd.read_parquet(
+        f'{insertions_path(data_path, screen_name, assembly)}/{chrom}',
+        columns=['pos', 'chan', 'strand'])
+
+    return count_gene_insertions(genes, insertions)
+
+
+def write_gene_stats(data_path: str, screen_name: str,
+                     assembly: str = 'hg38',
+                     max_workers: int = None) -> pd.DataFrame:
+
+    genes = collapse_genes(load_gene_annotations(data_path,
+                                                 assembly=assembly))
+    chrom_genes = dict(list(genes.groupby('chrom', sort=False)))
+    read = [c for c in list_chroms(data_path, screen_name, assembly)
+            if c in chrom_genes]
+
+    count = partial(chrom_gene_stats, data_path, screen_name, assembly)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        counted = dict(zip(read, executor.map(count, read,
+                                              [chrom_genes[c]
+                                               for c in read])))
+
+    no_insertions = pd.DataFrame({'pos': np.array([], dtype=np.int32),
+                                  'chan': np.array([], dtype=object),
+                                  'strand': np.array([], dtype=object)})
+    stats = pd.concat([counted[c] if c in counted
+                       else count_gene_insertions(chrom_genes[c],
+                                                  no_insertions)
+                       for c in chrom_genes], ignore_index=True)
+    stats[STAT_COLUMNS] = stats[STAT_COLUMNS].astype(np.int32)
+    out_path = f'{data_path}/screen-gene-stats/{screen_name}'
+    fs, fs_path = fsspec.core.url_to_fs(out_path)
+    fs.makedirs(fs_path, exist_ok=True)
+    stats.to_parquet(f'{out_path}/gene-stats-{assembly}.pq', index=False)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write per gene insertion counts of screens.')
+    parser.add_argument('data_path')
+    parser.add_argument('--screens', nargs='+', required=True)
+    parser.add_argument('--assembly', nargs='+', default=['hg19', 'hg38'])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    for screen_name in args.screens:
+        for assembly in args.assembly:
+            print(f'Counting gene insertions of {screen_name} {assembly}...')
+            write_gene_stats(args.data_path, screen_name, assembly=assembly,
+                             max_workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
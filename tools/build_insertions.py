@@ -0,0 +1,192 @@
+'''Rewrites the insertion files of screens so that window reads only touch
+the row groups of the window:
+
+    {data_path}/screen-insertions/{screen}/{assembly}/insertions.pq/{chrom}
+
+Each chromosome file is sorted by pos, written in small row groups with
+min/max statistics and with chan and strand dictionary encoded, and a
+_metadata file with the row group statistics of all chromosomes is written
+next to them. The validator reports how many bytes gene windows read, eg.:
+
+    python -m tools.build_insertions processed_data --screens screenA
+    python -m tools.build_insertions processed_data --screens screenA \\
+        --validate
+'''
+import argparse
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from tools.load_data import load_gene_annotations
+from tools.refseq import GeneIntervalIndex
+
+# Rows per row group: small enough that a gene window reads a few of them,
+# large enough to keep file footers small
+ROW_GROUP_SIZE = 20000
+DICTIONARY_COLUMNS = ['chan', 'strand']
+
+
+def insertions_path(data_path: str, screen_name: str, assembly: str) -> str:
+    return (f'{data_path}/screen-insertions/{screen_name}/{assembly}/'
+            'insertions.pq')
+
+
+def list_chroms(data_path: str, screen_name: str, assembly: str) -> list:
+    fs, fs_path = fsspec.core.url_to_fs(insertions_path(data_path,
+                                                        screen_name,
+                                                        assembly))
+    return sorted(path.rsplit('/', 1)[-1] for path in fs.ls(fs_path)
+                  if not path.rsplit('/', 1)[-1].startswith('_'))
+
+
+def sort_insertions(insertions: pd.DataFrame) -> pa.Table:
+    # Insertions sorted by pos as an arrow table, without pandas index
+    insertions = insertions.sort_values('pos', kind='stable',
+                                        ignore_index=True)
+
+    return pa.Table.from_pandas(insertions, preserve_index=False)
+
+
+def write_insertions(data_path: str, screen_name: str,
+                     assembly: str = 'hg38',
+                     row_group_size: int = ROW_GROUP_SIZE) -> None:
+
+    path = insertions_path(data_path, screen_name, assembly)
+    fs, fs_path = fsspec.core.url_to_fs(path)
+
+    collector = []
+    for chrom in list_chroms(data_path, screen_name, assembly):
+        print(f'Rewriting insertions of {screen_name} {assembly} {chrom}...')
+        with fs.open(f'{fs_path}/{chrom}', 'rb') as f:
+            table = sort_insertions(pd.read_parquet(f))
+
+        # Write next to the original and replace it when complete
+        with fs.open(f'{fs_path}/_{chrom}.tmp', 'wb') as f:
+            pq.write_table(table, f, row_group_size=row_group_size,
+                           use_dictionary=[c for c in DICTIONARY_COLUMNS
+                                           if c in table.column_names],
+                           write_statistics=True,
+                           metadata_collector=collector)
+        fs.mv(f'{fs_path}/_{chrom}.tmp', f'{fs_path}/{chrom}')
+
+        collector[-1].set_file_path(chrom)
+
+    # Row group statistics of all chromosome files
+    if collector:
+        metadata = collector[0]
+        for chrom_metadata in collector[1:]:
+            metadata.append_row_groups(chrom_metadata)
+        with fs.open(f'{fs_path}/_metadata', 'wb') as f:
+            metadata.write_metadata_file(f)
+
+
+def window_read_stats(path: str, start: int, end: int) -> dict:
+    '''Row groups and compressed bytes that reading insertions with
+    start <= pos <= end from the file at path needs, from the pos
+    statistics of its row groups.
+    '''
+    with fsspec.open(path, 'rb') as f:
+        metadata = pq.ParquetFile(f).metadata
+
+    pos_col = metadata.schema.names.index('pos')
+    groups = read_bytes = file_bytes = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        nbytes = sum(row_group.column(c).total_compressed_size
+                     for c in range(row_group.num_columns))
+        file_bytes += nbytes
+
+        stats = row_group.column(pos_col).statistics
+        if (stats is None or not stats.has_min_max
+                or (stats.min <= end and stats.max >= start)):
+            groups += 1
+            read_bytes += nbytes
+
+    return {'row_groups': groups, 'total_row_groups': metadata.num_row_groups,
+            'bytes': read_bytes + metadata.serialized_size,
+            'file_bytes': file_bytes}
+
+
+def check_layout(path: str) -> list:
+    # Problems of the layout of the insertion file at path
+    with fsspec.open(path, 'rb') as f:
+        metadata = pq.ParquetFile(f).metadata
+
+    problems = []
+    pos_col = metadata.schema.names.index('pos')
+    last_max = None
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(pos_col).statistics
+        if stats is None or not stats.has_min_max:
+            problems.append(f'row group {i} has no pos statistics')
+            continue
+        if last_max is not None and stats.min < last_max:
+            problems.append(f'row group {i} is not sorted by pos')
+        last_max = stats.max
+
+    return problems
+
+
+def validate_insertions(data_path: str, screen_name: str,
+                        assembly: str = 'hg38', padd: int = 200000,
+                        genes: int = 100) -> pd.DataFrame:
+    '''Bytes read by the windows (gene span +- padd, as loaded by the
+    browser) of a sample of genes of each chromosome, eg.:
+    chrom   row_groups  bytes   file_bytes  problems
+    chr9    3.0         71534   31845342    0
+    '''
+    refseq = load_gene_annotations(data_path, assembly=assembly)
+    gene_index = GeneIntervalIndex(refseq)
+    path = insertions_path(data_path, screen_name, assembly)
+
+    rng = np.random.default_rng(0)
+    report = []
+    for chrom in list_chroms(data_path, screen_name, assembly):
+        if chrom not in gene_index.chroms:
+            continue
+        spans = gene_index.chroms[chrom]
+        sample = rng.choice(len(spans['txStart']),
+                            min(genes, len(spans['txStart'])), replace=False)
+
+        stats = pd.DataFrame([window_read_stats(f'{path}/{chrom}',
+                                                spans['txStart'][i] - padd,
+                                                spans['txEnd'][i] + padd)
+                              for i in sample])
+        report.append({'chrom': chrom,
+                       'row_groups': stats['row_groups'].median(),
+                       'bytes': int(stats['bytes'].median()),
+                       'file_bytes': int(stats['file_bytes'].iloc[0]),
+                       'problems': len(check_layout(f'{path}/{chrom}'))})
+
+    return pd.DataFrame(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rewrite or validate the layout of insertion files.')
+    parser.add_argument('data_path')
+    parser.add_argument('--screens', nargs='+', required=True)
+    parser.add_argument('--assembly', nargs='+', default=['hg19', 'hg38'])
+    parser.add_argument('--row-group-size', type=int,
+                        default=ROW_GROUP_SIZE)
+    parser.add_argument('--validate', action='store_true',
+                        help='only report the bytes read by gene windows')
+    args = parser.parse_args()
+
+    for screen_name in args.screens:
+        for assembly in args.assembly:
+            if not args.validate:
+                write_insertions(args.data_path, screen_name,
+                                 assembly=assembly,
+                                 row_group_size=args.row_group_size)
+            print(f'Median window reads of {screen_name} {assembly}:')
+            print(validate_insertions(args.data_path, screen_name,
+                                      assembly=assembly).to_string(
+                                          index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+'''Exports the insertion and transcript plots of the browser for a list of
+genes, without a Bokeh server, as standalone HTML files or, when an export
+backend (selenium and a browser driver) is available, as PNG files:
+
+    {out_dir}/{screen}-{assembly}-{gene}.html
+
+Eg.:
+
+    python -m tools.export processed_data --genes JAK2 TP53 -o plots
+    python -m tools.export processed_data --genes-file panel.txt \\
+        --screens screenA screenB --png -o plots
+
+Genes are rendered in worker processes. Gene annotations are loaded once
+before the workers are forked, so they share them, and genes are sent to the
+workers in chunks of neighbouring genes of a chromosome, so the insertion
+cache of a worker answers the windows of a chunk from one read. Genes of
+chromosomes without insertions in a screen are skipped and reported.
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+from bokeh.embed import file_html
+from bokeh.resources import CDN
+
+from tools.build_insertions import list_chroms
+from tools.load_data import (get_gene_annotations, get_gene_index,
+                             load_insertions)
+from tools.panel import gene_windows, report_missing
+from tools.plotting.browser import BrowserView
+
+# Chunks of neighbouring genes spanning more than MAX_CHUNK_SPAN bp are read
+# gene by gene
+CHUNK_SIZE = 20
+MAX_CHUNK_SPAN = 5000000
+
+# Webdriver of the worker process, created by png_webdriver
+webdriver = None
+
+
+def png_webdriver():
+    # Webdriver used to export PNG files, or None if there is no export
+    # backend
+    global webdriver
+    if webdriver is None:
+        try:
+            from bokeh.io.webdriver import webdriver_control
+            webdriver = webdriver_control.get()
+        except Exception as e:
+            # Missing selenium or browser driver, or a driver that does not
+            # start
+            print(f'No PNG export backend ({e}), writing HTML.',
+                  file=sys.stderr)
+            webdriver = False
+
+    return webdriver or None
+
+
+def show_gene(view: Optional[BrowserView], data_path: str,
+              screen_name: str, assembly: str, chrom: str, start: int,
+              end: int, padd: int = 200000,
+              screen_type: str = 'ip') -> BrowserView:
+    # Plots of the browser for a gene, reusing the plots of view as the app
+    # does. All insertions of the window are in the plot source, as there is
+    # no server to send them when zooming in.
+    insertions = load_insertions(data_path, screen_name, chrom, start-padd,
+                                 end+padd, assembly=assembly)
+    refseq = get_gene_annotations(data_path, assembly=assembly)
+    gene_index = get_gene_index(data_path, assembly=assembly)
+
+    if view is None:
+        return BrowserView(insertions, screen_name, assembly, chrom, start,
+                           end, refseq, screen_type=screen_type,
+                           load_padd=padd, gene_index=gene_index,
+                           data_path=data_path)
+
+    view.show(insertions, screen_name, assembly, chrom, start, end, refseq,
+              gene_index=gene_index)
+    return view
+
+
+def export_chunk(data_path: str, screen_name: str, assembly: str,
+                 genes: list, out_dir: str, padd: int = 200000,
+                 screen_type: str = 'ip', png: bool = False) -> list:
+    '''Writes the plots of genes, a list of (gene, chrom, start, end) of one
+    chromosome, and returns the written paths. Runs in the worker processes.
+    '''
+    chrom = genes[0][1]
+    chunk_start = min(g[2] for g in genes) - padd
+    chunk_end = max(g[3] for g in genes) + padd
+    if chunk_end - chunk_start <= MAX_CHUNK_SPAN:
+        # Gene windows are then sliced from the cached chunk
+        load_insertions(data_path, screen_name, chrom, chunk_start,
+                        chunk_end, assembly=assembly)
+
+    driver = png_webdriver() if png else None
+    view = None
+    paths = []
+    for gene, chrom, start, end in genes:
+        view = show_gene(view, data_path, screen_name, assembly, chrom,
+                         start, end, padd=padd, screen_type=screen_type)
+        plots = view.plots
+        name = f'{screen_name}-{assembly}-{gene}'.replace(os.sep, '_')
+        title = f'{gene} - {screen_name} - {assembly}'
+
+        if driver is not None:
+            from bokeh.io import export_png
+            path = os.path.join(out_dir, f'{name}.png')
+            export_png(plots, filename=path, webdriver=driver)
+        else:
+            path = os.path.join(out_dir, f'{name}.html')
+            # The server callbacks of the plots (title updates, streaming)
+            # have no effect in static files
+            with open(path, 'w') as f:
+                f.write(file_html(plots, CDN, title,
+                                  suppress_callback_warning=True))
+        paths.append(path)
+
+    return paths
+
+
+def chunk_windows(windows, chunk_size: int = CHUNK_SIZE) -> list:
+    # Lists of at most chunk_size (gene, chrom, start, end) of neighbouring
+    # genes of a chromosome, from windows sorted by chromosome and start
+    chunks = []
+    for _, chrom_windows in windows.groupby('chrom', sort=False):
+        rows = list(chrom_windows.itertuples(index=False, name=None))
+        chunks += [rows[i:i+chunk_size]
+                   for i in range(0, len(rows), chunk_size)]
+
+    return chunks
+
+
+def export_genes(data_path: str, genes: list, screens: list,
+                 out_dir: str, assemblies: list = ['hg38'],
+                 padd: int = 200000, screen_type: str = 'ip',
+                 png: bool = False, max_workers: Optional[int] = None,
+                 chunk_size: int = CHUNK_SIZE) -> list:
+    '''Exports the plots of genes in all screens and assemblies to out_dir,
+    reporting progress and throughput on stderr. Returns the written paths.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+
+    tasks = []
+    skipped = []
+    for assembly in assemblies:
+        # Loaded before the workers are forked, see module docstring
+        get_gene_annotations(data_path, assembly=assembly)
+        windows, missing = gene_windows(data_path, genes, assembly=assembly)
+        report_missing(missing, assembly)
+        chunks = chunk_windows(windows, chunk_size=chunk_size)
+
+        for screen_name in screens:
+            chroms = set(list_chroms(data_path, screen_name, assembly))
+            for chunk in chunks:
+                if chunk[0][1] in chroms:
+                    tasks.append((screen_name, assembly, chunk))
+                else:
+                    skipped += [f'{screen_name}-{assembly}-{gene}'
+                                for gene, _, _, _ in chunk]
+
+    total = sum(len(chunk) for _, _, chunk in tasks)
+    mp_context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+
+    paths = []
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=mp_context) as executor:
+        futures = [executor.submit(export_chunk, data_path, screen_name,
+                                   assembly, chunk, out_dir, padd=padd,
+                                   screen_type=screen_type, png=png)
+                   for screen_name, assembly, chunk in tasks]
+        for future in as_completed(futures):
+            paths += future.result()
+            elapsed = time.perf_counter() - t0
+            # Overwritten by the next progress line
+            print(f'{len(paths):,}/{total:,} plots, '
+                  f'{len(paths) / elapsed * 60:,.0f} plots/minute',
+                  end='\r', file=sys.stderr)
+    if tasks:
+        print(file=sys.stderr)
+
+    elapsed = time.perf_counter() - t0
+    print(f'Exported {len(paths):,} plots in {elapsed:.1f} s '
+          f'({len(paths) / max(elapsed, 1e-9) * 60:,.0f} plots/minute) '
+          f'to {out_dir}', file=sys.stderr)
+    if skipped:
+        print(f'{len(skipped)} plots skipped, no insertions on their '
+              f'chromosome: {", ".join(skipped[:10])}'
+              f'{"..." if len(skipped) > 10 else ""}', file=sys.stderr)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export the insertion plots of a list of genes.')
+    parser.add_argument('data_path')
+    genes = parser.add_mutually_exclusive_group(required=True)
+    genes.add_argument('--genes', nargs='+')
+    genes.add_argument('--genes-file',
+                       help='file with one gene symbol per line')
+    parser.add_argument('--screens', nargs='+', default=['screenA'])
+    parser.add_argument('--assembly', nargs='+', default=['hg38'])
+    parser.add_argument('--padd', type=int, default=200000,
+                        help='bp of insertions loaded on both sides of genes')
+    parser.add_argument('--screen-type', default='ip',
+                        choices=['ip', 'pa', 'sl'],
+                        help="lanes and colors of the insertions, 'sl' "
+                        "screens need a replicate column")
+    parser.add_argument('--png', action='store_true',
+                        help='write PNG files if an export backend is '
+                        'available')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('-o', '--out-dir', required=True)
+    args = parser.parse_args()
+
+    if args.genes_file:
+        with open(args.genes_file) as f:
+            genes = [line.strip() for line in f if line.strip()]
+    else:
+        genes = args.genes
+
+    export_genes(args.data_path, genes, args.screens, args.out_dir,
+                 assemblies=args.assembly, padd=args.padd,
+                 screen_type=args.screen_type, png=args.png,
+                 max_workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
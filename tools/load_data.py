@@ -1,22 +1,467 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import fsspec
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+
+from tools.metrics import metrics
+from tools.refseq import GeneIntervalIndex, GeneSymbolIndex
+
+
+class InsertionCache():
+    '''Memory bounded LRU cache of insertion windows, shared by all sessions
+    of the server process. Windows are kept per (data_path, screen, assembly,
+    chrom, start, end) and any window contained in a cached one is answered
+    by slicing it.
+    '''
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.windows = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, data_path: str, screen_name: str, assembly: str,
+            chrom: str, start: int, end: int,
+            columns: Optional[list] = None) -> Optional[pd.DataFrame]:
+        # Returns insertions with start <= pos <= end, only columns if given,
+        # or None if no cached window with these columns contains start-end
+        with self.lock:
+            for key, (insertions, nbytes) in reversed(self.windows.items()):
+                if (key[:4] == (data_path, screen_name, assembly, chrom)
+                        and key[4] <= start and end <= key[5]
+                        and (columns is None
+                             or set(columns) <= set(insertions.columns))):
+                    self.windows.move_to_end(key)
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+                return None
+
+        pos = insertions['pos'].values
+        lims = (np.searchsorted(pos, start, side='left'),
+                np.searchsorted(pos, end, side='right'))
+        window = insertions.iloc[lims[0]:lims[1]]
+
+        if columns is not None:
+            # Selecting columns copies them
+            return window[list(columns)]
+        return window.copy()
+
+    def contains(self, data_path: str, screen_name: str, assembly: str,
+                 chrom: str, start: int, end: int) -> bool:
+        # As get, without counting a hit or miss or copying insertions
+        with self.lock:
+            return any(key[:4] == (data_path, screen_name, assembly, chrom)
+                       and key[4] <= start and end <= key[5]
+                       for key in self.windows)
+
+    def put(self, data_path: str, screen_name: str, assembly: str,
+            chrom: str, start: int, end: int,
+            insertions: pd.DataFrame) -> None:
+        # Insertions must be sorted by pos
+        nbytes = int(insertions.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        key = (data_path, screen_name, assembly, chrom, start, end)
+        with self.lock:
+            # Drop windows contained in the new one
+            for other in list(self.windows):
+                if (other[:4] == key[:4] and start <= other[4]
+                        and other[5] <= end):
+                    self.nbytes -= self.windows.pop(other)[1]
+
+            self.windows[key] = (insertions, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.windows.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.windows.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'windows': len(self.windows), 'bytes': self.nbytes}
+
+
+def file_version(info: dict) -> list:
+    # Version of a file from its fsspec info: generation, etag or
+    # modification time, and size, depending on the filesystem
+    return [info.get(k) for k in ('generation', 'etag', 'ETag', 'mtime',
+                                  'updated', 'size')]
+
+
+class DiskCache():
+    '''Size bounded read-through cache of data files on local disk, so that
+    server restarts and the workers of a host share files downloaded from
+    the bucket. Files are stored under a hash of their url and of their
+    version (see file_version), so a file updated in the bucket is
+    downloaded again. The version of a url is checked at most every
+    check_interval seconds, reads in between use the local file without
+    asking the bucket. The least recently read files are deleted when the
+    cache exceeds max_bytes.
+
+    Directories (partitioned datasets) are not cached and their url is
+    returned as is: pyarrow lists and filters their files on every read,
+    which would need a local copy of the whole directory. The data files of
+    the app are single files.
+    '''
+
+    def __init__(self, cache_dir: str, max_bytes: int,
+                 min_age: Optional[int] = 60,
+                 check_interval: Optional[int] = 300) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Files read in the last min_age seconds are not deleted, as another
+        # worker may be about to open them
+        self.min_age = min_age
+        self.check_interval = check_interval
+        # Local path and time of the last version check, by url
+        self.checked = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, url: str) -> str:
+        # Local copy of the file at url, downloaded if needed
+        with self.lock:
+            path, checked = self.checked.get(url, (None, 0))
+        if (path is not None and time.time() - checked < self.check_interval
+                and os.path.exists(path)):
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+            return path
+
+        fs, fs_path = fsspec.core.url_to_fs(url)
+        info = fs.info(fs_path)
+        if info['type'] != 'file':
+            return url
 
+        key = hashlib.sha1(f'{url} {file_version(info)}'.encode()).hexdigest()
+        path = os.path.join(self.cache_dir, key)
 
+        if os.path.exists(path):
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+        else:
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            fs.get_file(fs_path, tmp_path)
+            os.replace(tmp_path, path)
+            with self.lock:
+                self.misses += 1
+            self.evict()
+
+        with self.lock:
+            self.checked[url] = (path, time.time())
+
+        return path
+
+    def evict(self) -> None:
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        nbytes = sum(size for _, size, _ in files)
+        now = time.time()
+        for mtime, size, path in sorted(files):
+            if nbytes <= self.max_bytes or now - mtime < self.min_age:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+# Data of the deployed app, a local copy when developing on macOS
+DATA_PATH = 'gs://gisetia-insertion-browser/processed_data'
+if os.uname().sysname == 'Darwin':
+    DATA_PATH = 'processed_data'
+
+insertion_cache = InsertionCache(
+    max_bytes=int(os.environ.get('INSERTION_CACHE_MB', 512)) * 2**20)
+
+# Data files are read through a DiskCache in DISK_CACHE_DIR, when set
+disk_cache = None
+if os.environ.get('DISK_CACHE_DIR'):
+    disk_cache = DiskCache(
+        os.environ['DISK_CACHE_DIR'],
+        max_bytes=int(os.environ.get('DISK_CACHE_MB', 4096)) * 2**20)
+
+# Insertion columns read by default: the ones the insertion plots of 'ip'
+# screens need, and the optional ones of other screen types when the file
+# has them ('sl' screens also need 'replicate')
+INSERTION_COLUMNS = ('pos', 'chan', 'strand')
+OPTIONAL_INSERTION_COLUMNS = ('replicate',)
+
+# Bin sizes (bp) of the insertion densities written by tools.build_density
+DENSITY_BIN_SIZES = [100, 1000, 10000, 100000, 1000000]
+GENOME_BIN_SIZE = 1000000
+
+# Gene annotations loaded by get_gene_annotations and their indexes, by
+# (data_path, assembly, known, coding)
+annotation_store = {}
+gene_index_store = {}
+gene_symbol_store = {}
+annotation_lock = threading.Lock()
+
+# Column names and last position of the insertion files read by
+# insertion_file_info, by url
+insertion_file_store = {}
+
+# Genome-wide densities loaded by get_genome_density, by
+# (data_path, screen_name, assembly)
+genome_density_store = {}
+# Per gene insertion counts loaded by get_gene_stats, by
+# (data_path, screen_name, assembly)
+gene_stats_store = {}
+
+
+def data_file(url):
+    # Path to read url from, through the disk cache if enabled
+    if disk_cache is None:
+        return url
+
+    return disk_cache.path(url)
+
+
+def parse_region(region):
+    # 1-based region, eg. chr9:5,450,503-5,470,567, as 0-based left-closed
+    # right-open (chrom, start, end)
+    chrom, span = region.split(':')
+    start, end = span.split('-')
+
+    return (f'chr{chrom[3:]}', int(start.replace(',', '')) - 1,
+            int(end.replace(',', '')))
+
+
+@metrics.timed('load_gene_annotations')
 def load_gene_annotations(data_path, assembly='hg38', known=True,
                           coding=True):
 
     filters = [("known", "==", known), ("coding", "==", coding)]
-    refseq = pd.read_parquet(f'{data_path}/refseq/ncbi-genes-{assembly}.pq',
-                             filters=filters)
+    refseq = pd.read_parquet(
+        data_file(f'{data_path}/refseq/ncbi-genes-{assembly}.pq'),
+        filters=filters)
 
     return refseq
 
 
+def get_gene_annotations(data_path, assembly='hg38', known=True,
+                         coding=True):
+    '''Returns gene annotations as load_gene_annotations, reading them only
+    once per server process. Sessions get a shallow copy of the stored
+    dataframe: columns can be added to it but values must not be modified.
+    '''
+    key = (data_path, assembly, known, coding)
+    with annotation_lock:
+        if key not in annotation_store:
+            annotation_store[key] = load_gene_annotations(
+                data_path, assembly=assembly, known=known, coding=coding)
+            gene_index_store[key] = GeneIntervalIndex(annotation_store[key])
+            gene_symbol_store[key] = GeneSymbolIndex(annotation_store[key])
+        refseq = annotation_store[key]
+
+    return refseq.copy(deep=False)
+
+
+def get_gene_index(data_path, assembly='hg38', known=True, coding=True):
+    # Returns the GeneIntervalIndex of the annotations of get_gene_annotations
+    get_gene_annotations(data_path, assembly=assembly, known=known,
+                         coding=coding)
+
+    return gene_index_store[(data_path, assembly, known, coding)]
+
+
+def get_gene_symbols(data_path, assembly='hg38', known=True, coding=True):
+    # Returns the GeneSymbolIndex of the annotations of get_gene_annotations
+    get_gene_annotations(data_path, assembly=assembly, known=known,
+                         coding=coding)
+
+    return gene_symbol_store[(data_path, assembly, known, coding)]
+
+
+def load_exon_regions(data_path, chrom, start, end, assembly='hg38'):
+    # Exon regions (see tools.build_exon_regions) overlapping start-end
+
+    filters = [("end", ">", start), ("start", "<=", end)]
+    regions = pd.read_parquet(
+        data_file(f'{data_path}/refseq/exon-regions-{assembly}.pq/{chrom}'),
+        filters=filters)
+
+    return regions
+
+
+def compact_insertions(insertions):
+    # Positions as int32 (chromosome positions fit) and labels as categories
+    insertions = insertions.astype({'pos': 'int32'}, copy=False)
+    for col in ('chr', 'chan', 'strand', 'replicate'):
+        if col in insertions.columns:
+            insertions[col] = insertions[col].astype('category')
+
+    return insertions
+
+
+def insertions_url(data_path, screen_name, assembly, chrom):
+    return (f'{data_path}/screen-insertions/{screen_name}/{assembly}/'
+            f'insertions.pq/{chrom}')
+
+
+def insertion_file_info(url):
+    # Column names of the insertion file at url and its last position, from
+    # the statistics of its row groups (None without statistics). Its footer
+    # is read once per server process.
+    with annotation_lock:
+        info = insertion_file_store.get(url)
+    if info is None:
+        fs, fs_path = fsspec.core.url_to_fs(data_file(url))
+        with fs.open(fs_path, 'rb') as f:
+            metadata = pq.read_metadata(f)
+        names = metadata.schema.names
+
+        last_pos = None
+        if 'pos' in names:
+            stats = [metadata.row_group(i).column(names.index('pos'))
+                     .statistics for i in range(metadata.num_row_groups)]
+            if all(s is not None and s.has_min_max for s in stats):
+                last_pos = max((s.max for s in stats), default=0)
+
+        info = (names, last_pos)
+        with annotation_lock:
+            insertion_file_store[url] = info
+
+    return info
+
+
+def insertion_columns(url):
+    # INSERTION_COLUMNS and the OPTIONAL_INSERTION_COLUMNS the insertion file
+    # at url has
+    names, _ = insertion_file_info(url)
+
+    return INSERTION_COLUMNS + tuple(c for c in OPTIONAL_INSERTION_COLUMNS
+                                     if c in names)
+
+
+def last_insertion(data_path, screen_name, assembly, chrom):
+    # Position of the last insertion of a chromosome, or None if unknown
+    _, last_pos = insertion_file_info(insertions_url(data_path, screen_name,
+                                                     assembly, chrom))
+
+    return last_pos
+
+
+@metrics.timed('load_insertions')
 def load_insertions(data_path, screen_name, chrom, start, end,
-                    assembly='hg38'):
+                    assembly='hg38', cache=True, columns=None):
+    # Insertions with start <= pos <= end. Columns default to
+    # insertion_columns of the chromosome file.
+
+    url = insertions_url(data_path, screen_name, assembly, chrom)
+    columns = list(insertion_columns(url) if columns is None else columns)
+
+    if cache:
+        insertions = insertion_cache.get(data_path, screen_name, assembly,
+                                         chrom, start, end, columns=columns)
+        if insertions is not None:
+            return insertions
 
     filters = [("pos", ">=", start), ("pos", "<=", end)]
-    insertions = pd.read_parquet(f'{data_path}/screen-insertions/'
-                                 f'{screen_name}/{assembly}/insertions.pq/'
-                                 f'{chrom}', filters=filters)
+    insertions = pd.read_parquet(data_file(url), columns=columns,
+                                 filters=filters)
+    insertions = compact_insertions(insertions)
+
+    if cache:
+        insertions = insertions.sort_values('pos', kind='stable',
+                                            ignore_index=True)
+        insertion_cache.put(data_path, screen_name, assembly, chrom, start,
+                            end, insertions)
+        insertions = insertions.copy()
 
     return insertions
+
+
+def density_bin_size(start, end, width, bin_sizes=DENSITY_BIN_SIZES):
+    # Largest bin size with at least one bin per pixel of a plot width pixels
+    # wide showing start-end
+    fitting = [b for b in bin_sizes if (end - start) / b >= width]
+
+    return max(fitting) if fitting else min(bin_sizes)
+
+
+def load_density(data_path, screen_name, chrom, start, end, width=1000,
+                 assembly='hg38'):
+    '''Insertion counts per channel and strand (see tools.build_density) of
+    the bins overlapping start-end, at the resolution for a plot width
+    pixels wide. Eg. for chr9:5,000,000-6,000,000:
+    start       end         high+   high-   low+    low-
+    5021000     5022000     12      3       0       1
+    '''
+    bin_size = density_bin_size(start, end, width)
+
+    filters = [("start", ">", start - bin_size), ("start", "<=", end)]
+    density = pd.read_parquet(
+        data_file(f'{data_path}/screen-density/{screen_name}/{assembly}/'
+                  f'density-{bin_size}.pq/{chrom}'),
+        filters=filters)
+    density.insert(1, 'end', density['start'] + bin_size)
+
+    return density
+
+
+def get_genome_density(data_path, screen_name, assembly='hg38'):
+    '''Insertion counts per channel and strand in bins of GENOME_BIN_SIZE
+    of all chromosomes (see tools.build_density), read once per server
+    process. Eg.:
+    chrom   start       end         high+   high-   low+    low-
+    chr1    0           1000000     1005    985     943     984
+    '''
+    key = (data_path, screen_name, assembly)
+    with annotation_lock:
+        if key not in genome_density_store:
+            density = pd.read_parquet(
+                data_file(f'{data_path}/screen-density/{screen_name}/'
+                          f'{assembly}/genome-density.pq'))
+            density.insert(2, 'end', density['start'] + GENOME_BIN_SIZE)
+            genome_density_store[key] = density
+
+    return genome_density_store[key]
+
+
+def get_gene_stats(data_path, screen_name, assembly='hg38'):
+    # Insertion counts per gene (see tools.build_gene_stats) indexed by
+    # name_chrom, read once per server process
+    key = (data_path, screen_name, assembly)
+    with annotation_lock:
+        if key not in gene_stats_store:
+            stats = pd.read_parquet(
+                data_file(f'{data_path}/screen-gene-stats/{screen_name}/'
+                          f'gene-stats-{assembly}.pq'))
+            gene_stats_store[key] = stats.set_index('name_chrom')
+
+    return gene_stats_store[key]
@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+from bokeh.document import Document
+
+# Threads shared by all sessions of the server process for reading data.
+# Parquet reads and gcsfs release the GIL, so loads of different sessions
+# overlap instead of queuing on the server event loop.
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('LOADER_THREADS', 8)),
+    thread_name_prefix='loader')
+
+
+class SessionLoader():
+    '''Runs the data loading of a session in the shared executor and applies
+    the result to its document on the event loop, following Bokeh's pattern
+    for updating documents from other threads:
+
+        loader = SessionLoader(curdoc())
+        loader.submit(partial(load_insertions, ...), show_insertions)
+
+    Only the last submitted load is shown: submitting a new one cancels the
+    previous load if it has not started yet, and discards its result
+    otherwise.
+    '''
+
+    def __init__(self, doc: Document) -> None:
+        self.doc = doc
+        self.generation = 0
+        self.future = None
+
+    def submit(self, load: Callable, show: Callable,
+               error: Optional[Callable] = None) -> Future:
+        # load() runs in the executor, show(result) or error(exception) on
+        # the event loop with the document lock held
+
+        self.generation += 1
+        generation = self.generation
+        if self.future is not None:
+            self.future.cancel()
+
+        def done(future):
+            if future.cancelled() or generation != self.generation:
+                return
+            exception = future.exception()
+            if exception is None:
+                callback = partial(self.apply, generation, show,
+                                   future.result())
+            elif error is not None:
+                callback = partial(self.apply, generation, error, exception)
+            else:
+                callback = partial(self.apply, generation, self.reraise,
+                                   exception)
+            self.doc.add_next_tick_callback(callback)
+
+        self.future = executor.submit(load)
+        self.future.add_done_callback(done)
+
+        return self.future
+
+    def apply(self, generation: int, func: Callable, result) -> None:
+        # A newer load may have been submitted since the result arrived
+        if generation == self.generation:
+            func(result)
+
+    @staticmethod
+    def reraise(exception: BaseException) -> None:
+        # Raised on the event loop, where Bokeh logs callback errors
+        raise exception
@@ -0,0 +1,166 @@
+import functools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import numpy as np
+from bokeh.document import Document
+from bokeh.document.events import DocumentPatchedEvent
+from bokeh.protocol import Protocol
+
+# Document patches are only measured when METRICS_PATCH_SIZE is 1, as it
+# serializes every patch once more on the server event loop
+PATCH_SIZE = os.environ.get('METRICS_PATCH_SIZE') == '1'
+# The app shows the stages of the last window loaded when METRICS_UI is 1
+SHOW_IN_UI = os.environ.get('METRICS_UI') == '1'
+
+
+def message_size(msg) -> int:
+    # Bytes written to the websocket for a Bokeh protocol message
+    size = (len(msg.header_json) + len(msg.metadata_json)
+            + len(msg.content_json))
+    for buf_header, buf_payload in msg.buffers:
+        size += len(buf_payload)
+    return size
+
+
+class Trace():
+    # Stages of one request, eg. a gene load, and their values
+    def __init__(self, name: str, detail: str = '') -> None:
+        self.name = name
+        self.detail = detail
+        self.time = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'detail': self.detail,
+                'time': self.time,
+                'spans': [{'stage': stage, 'value': round(value, 3)}
+                          for stage, value in self.spans]}
+
+
+class Metrics():
+    '''Rolling values of the stages of the server process, eg. the
+    milliseconds of each load_insertions call or the bytes of each document
+    patch, shared by all sessions. Percentiles are computed over the last
+    window values of each stage, and the traces of the last requests (at
+    most traces) are kept:
+
+        with metrics.span('load_insertions'):
+            ...
+
+        @metrics.timed('load_insertions')
+        def load_insertions(...):
+
+    Spans run while a trace is active in the thread (see tracing) are also
+    added to the trace, so the stages of a request can be followed across
+    the loader threads and the event loop.
+    '''
+
+    def __init__(self, window: int = 1000, traces: int = 100) -> None:
+        self.values = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+        self.traces = deque(maxlen=traces)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, value: float) -> None:
+        with self.lock:
+            self.values[stage].append(value)
+            self.counts[stage] += 1
+            trace = getattr(self.local, 'trace', None)
+            if trace is not None:
+                trace.spans.append((stage, value))
+
+    @contextmanager
+    def span(self, stage: str):
+        # Records the milliseconds of the block
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - t0) * 1000)
+
+    def timed(self, stage: str) -> Callable:
+        # Decorator recording the milliseconds of each call
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def tracing(self, trace: Optional[Trace]):
+        # Adds the spans of the block to trace, in this thread
+        previous = getattr(self.local, 'trace', None)
+        self.local.trace = trace
+        try:
+            yield trace
+        finally:
+            self.local.trace = previous
+
+    @contextmanager
+    def patch_size(self, doc: Document):
+        # Records the bytes of the PATCH-DOC message Bokeh sends for the
+        # changes made to doc in the block (patch_bytes) and the milliseconds
+        # of serializing it (patch_serialize)
+        if not PATCH_SIZE:
+            yield
+            return
+
+        events = []
+
+        def collect(event):
+            # Session callbacks added in the block are not sent to the
+            # browser
+            if isinstance(event, DocumentPatchedEvent):
+                events.append(event)
+
+        doc.on_change(collect)
+        try:
+            yield
+        finally:
+            doc.remove_on_change(collect)
+        if events:
+            with self.span('patch_serialize'):
+                size = message_size(Protocol().create('PATCH-DOC', events))
+            self.record('patch_bytes', size)
+
+    def finish(self, trace: Trace) -> None:
+        # Records the milliseconds since trace was created as stage
+        # trace.name and keeps the trace
+        with self.tracing(trace):
+            self.record(trace.name, (time.perf_counter() - trace.t0) * 1000)
+        with self.lock:
+            self.traces.append(trace)
+
+    def summary(self) -> dict:
+        '''Calls and percentiles of the last values of each stage, and the
+        last traces, eg.:
+        {'stages': {'load_insertions': {'count': 12, 'p50': 41.2,
+                                        'p95': 230.5, 'max': 251.0}, ...},
+         'traces': [{'name': 'window', 'detail': 'screenA hg38 ...',
+                     'spans': [{'stage': 'load_insertions', ...}, ...]}]}
+        '''
+        with self.lock:
+            values = {stage: np.array(v) for stage, v in self.values.items()}
+            counts = dict(self.counts)
+            traces = [trace.to_dict() for trace in self.traces]
+
+        stages = {}
+        for stage in sorted(values):
+            p50, p95 = np.percentile(values[stage], [50, 95])
+            stages[stage] = {'count': counts[stage], 'p50': round(p50, 3),
+                             'p95': round(p95, 3),
+                             'max': round(values[stage].max(), 3)}
+
+        return {'stages': stages, 'traces': traces}
+
+
+metrics = Metrics()
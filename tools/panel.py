@@ -0,0 +1,218 @@
+'''Insertions of a panel of genes in several screens and assemblies, eg.:
+
+    python -m tools.panel processed_data --genes JAK2 TP53 \\
+        --screens screenA screenB -o panel.pq
+    python -m tools.panel processed_data --genes-file panel.txt \\
+        --assembly hg38 --padd 5000 -o panel.arrow
+
+Gene windows (first txStart to last txEnd of the gene, widened by padd) are
+grouped by chromosome and overlapping windows merged, so each chromosome
+file of a screen is read once, with one filter per merged window, in
+parallel processes. Insertions are returned once per gene window they fall
+in, eg.:
+screen      assembly    gene    chrom   pos         chan    strand
+screenA     hg38        JAK2    chr9    4985118     high    +
+'''
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from tools.build_insertions import list_chroms
+from tools.load_data import (INSERTION_COLUMNS, compact_insertions,
+                             data_file, get_gene_symbols, insertion_columns,
+                             insertions_url)
+
+
+def gene_windows(data_path: str, genes: list, assembly: str = 'hg38',
+                 padd: int = 0) -> tuple:
+    '''Windows of genes (name_chrom symbols) sorted by chromosome and start,
+    and the genes not annotated in assembly. Eg.:
+    gene    chrom   start       end
+    JAK2    chr9    4985032     5128183
+    '''
+    symbols = get_gene_symbols(data_path, assembly=assembly)
+
+    rows = []
+    missing = []
+    for gene in dict.fromkeys(genes):
+        span = symbols.lookup(gene)
+        if span is None:
+            missing.append(gene)
+        else:
+            rows.append((gene, span[0], max(span[1] - padd, 0),
+                         span[2] + padd))
+
+    windows = pd.DataFrame(rows, columns=['gene', 'chrom', 'start', 'end'])
+    windows = windows.sort_values(['chrom', 'start'], kind='stable',
+                                  ignore_index=True)
+
+    return windows, missing
+
+
+def report_missing(missing: list, assembly: str) -> None:
+    if missing:
+        print(f'{len(missing)} genes not found in {assembly}: '
+              f'{", ".join(missing[:10])}'
+              f'{"..." if len(missing) > 10 else ""}', file=sys.stderr)
+
+
+def merge_windows(windows: pd.DataFrame) -> pd.DataFrame:
+    # Overlapping windows of one chromosome merged, sorted by start. A
+    # window starts a merged window if it starts after the end of all the
+    # windows before it.
+    windows = windows.sort_values('start', kind='stable')
+    starts = windows['start'].values
+    ends = windows['end'].values
+
+    reach = np.maximum.accumulate(ends)
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(new)
+
+    return pd.DataFrame({'start': starts[first],
+                         'end': np.maximum.reduceat(ends, first)
+                         if len(first) else ends[:0]})
+
+
+def read_panel_chrom(data_path: str, screen_name: str, assembly: str,
+                     chrom: str, windows: pd.DataFrame,
+                     columns: Optional[list] = None) -> pd.DataFrame:
+    '''Insertions of the gene windows of one chromosome, read at once with a
+    filter per merged window, with a gene column. Columns default to
+    insertion_columns of the chromosome file. Runs in the worker processes.
+    '''
+    url = insertions_url(data_path, screen_name, assembly, chrom)
+    if columns is None:
+        columns = insertion_columns(url)
+
+    merged = merge_windows(windows)
+    filters = [[("pos", ">=", int(start)), ("pos", "<=", int(end))]
+               for start, end in zip(merged['start'], merged['end'])]
+    insertions = pd.read_parquet(data_file(url), columns=list(columns),
+                                 filters=filters)
+    insertions = compact_insertions(insertions).sort_values(
+        'pos', kind='stable', ignore_index=True)
+
+    # Rows of the insertions of each window, one after another
+    pos = insertions['pos'].values
+    lo = np.searchsorted(pos, windows['start'].values, side='left')
+    hi = np.searchsorted(pos, windows['end'].values, side='right')
+    counts = hi - lo
+    rows = (np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+            + np.repeat(lo, counts))
+
+    panel = insertions.iloc[rows].reset_index(drop=True)
+    panel.insert(0, 'chrom', chrom)
+    panel.insert(0, 'gene', np.repeat(windows['gene'].values, counts))
+
+    return panel
+
+
+def query_panel(data_path: str, genes: list, screens: list,
+                assemblies: list = ['hg38'], padd: int = 0,
+                columns: Optional[list] = None,
+                max_workers: int = None) -> pd.DataFrame:
+    '''Insertions of the windows of genes in all screens and assemblies, with
+    screen, assembly, gene and chrom columns (see module docstring). Genes
+    not annotated in an assembly and genes of chromosomes without insertion
+    files are skipped and reported on stderr. Columns default to the ones
+    of each file (see tools.load_data.insertion_columns), missing values
+    are left empty when screens have different columns.
+    '''
+    tasks = []
+    skipped = []
+    for assembly in assemblies:
+        windows, missing = gene_windows(data_path, genes, assembly=assembly,
+                                        padd=padd)
+        report_missing(missing, assembly)
+
+        for screen_name in screens:
+            chroms = set(list_chroms(data_path, screen_name, assembly))
+            for chrom, chrom_windows in windows.groupby('chrom', sort=False):
+                if chrom in chroms:
+                    tasks.append((screen_name, assembly, chrom,
+                                  chrom_windows))
+                else:
+                    skipped += [f'{screen_name}-{assembly}-{gene}'
+                                for gene in chrom_windows['gene']]
+    if skipped:
+        print(f'{len(skipped)} gene windows skipped, no insertions on their '
+              f'chromosome: {", ".join(skipped[:10])}'
+              f'{"..." if len(skipped) > 10 else ""}', file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_panel_chrom, data_path, screen_name,
+                                   assembly, chrom, chrom_windows,
+                                   columns=columns)
+                   for screen_name, assembly, chrom, chrom_windows in tasks]
+        parts = [future.result().assign(screen=screen_name,
+                                        assembly=assembly)
+                 for future, (screen_name, assembly, _, _) in zip(futures,
+                                                                  tasks)]
+
+    first_columns = ['screen', 'assembly', 'gene', 'chrom']
+    if not parts:
+        return pd.DataFrame(columns=first_columns
+                            + list(columns or INSERTION_COLUMNS))
+
+    panel = pd.concat(parts, ignore_index=True)
+    panel = panel[first_columns + [c for c in panel.columns
+                                   if c not in first_columns]]
+    for col in ('screen', 'assembly', 'gene', 'chrom', 'chan', 'strand',
+                'replicate'):
+        if col in panel.columns:
+            panel[col] = panel[col].astype('category')
+
+    return panel
+
+
+def write_panel(panel: pd.DataFrame, path: str) -> None:
+    # Arrow IPC (feather) files for .arrow or .feather paths, else parquet
+    if path.endswith(('.arrow', '.feather')):
+        panel.to_feather(path)
+    else:
+        panel.to_parquet(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write the insertions of a panel of genes.')
+    parser.add_argument('data_path')
+    genes = parser.add_mutually_exclusive_group(required=True)
+    genes.add_argument('--genes', nargs='+')
+    genes.add_argument('--genes-file',
+                       help='file with one gene symbol per line')
+    parser.add_argument('--screens', nargs='+', default=['screenA',
+                                                         'screenB'])
+    parser.add_argument('--assembly', nargs='+', default=['hg19', 'hg38'])
+    parser.add_argument('--padd', type=int, default=0,
+                        help='bp added on both sides of gene windows')
+    parser.add_argument('--columns', nargs='+', default=None,
+                        help='insertion columns, by default the ones of '
+                        'the files')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('-o', '--output', required=True,
+                        help='.pq/.parquet or .arrow/.feather file')
+    args = parser.parse_args()
+
+    if args.genes_file:
+        with open(args.genes_file) as f:
+            genes = [line.strip() for line in f if line.strip()]
+    else:
+        genes = args.genes
+
+    panel = query_panel(args.data_path, genes, args.screens,
+                        assemblies=args.assembly, padd=args.padd,
+                        columns=args.columns, max_workers=args.workers)
+    write_panel(panel, args.output)
+    print(f'Wrote {len(panel):,} insertions of {panel["gene"].nunique():,} '
+          f'genes to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
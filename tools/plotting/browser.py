@@ -0,0 +1,62 @@
+import pandas as pd
+from typing import Optional
+from bokeh.layouts import column
+
+from tools.metrics import metrics
+from tools.plotting.insertions import InsertionPlot
+from tools.plotting.transcripts import TranscriptPlot
+from tools.refseq import GeneIntervalIndex
+
+
+class BrowserView():
+    '''Insertion plot, range selector and transcript track of the browser.
+    The figures are created once and kept alive: showing another gene,
+    screen or position only updates their sources and ranges, so Bokeh sends
+    data changes instead of a new document.
+    '''
+
+    @metrics.timed('browser_view')
+    def __init__(self, insertions: pd.DataFrame, screen_name: str,
+                 assembly: str, chrom: str, start: int, end: int,
+                 refseq: pd.DataFrame,
+                 screen_type: Optional[str] = 'ip',
+                 load_padd: Optional[int] = 300000,
+                 lod_threshold: Optional[int] = None,
+                 gene_index: Optional[GeneIntervalIndex] = None,
+                 data_path: Optional[str] = None) -> None:
+
+        self.screen_type = screen_type
+
+        self.ins = InsertionPlot(insertions, screen_name, assembly, chrom,
+                                 start, end, screen_type=screen_type,
+                                 jitter_ins=True, load_padd=load_padd,
+                                 lod_threshold=lod_threshold)
+        self.ins.hover_position()
+
+        self.select = InsertionPlot(insertions, screen_name, assembly, chrom,
+                                    start, end, screen_type=screen_type,
+                                    jitter_ins=True, load_padd=load_padd,
+                                    source=self.ins.source,
+                                    lod_threshold=lod_threshold)
+        self.select.for_selection(self.ins.plt)
+
+        self.transcript = TranscriptPlot(refseq, assembly, chrom, start, end,
+                                         load_padd=load_padd,
+                                         gene_index=gene_index,
+                                         data_path=data_path)
+        self.transcript.link_ins(self.ins.plt)
+
+        self.plots = column(self.ins.div_title, self.transcript.plt,
+                            self.ins.plt, self.select.plt, name='plots')
+
+    @metrics.timed('browser_view_show')
+    def show(self, insertions: pd.DataFrame, screen_name: str, assembly: str,
+             chrom: str, start: int, end: int, refseq: pd.DataFrame,
+             gene_index: Optional[GeneIntervalIndex] = None) -> None:
+        # Show another window in the existing plots
+
+        self.ins.update(insertions, screen_name, assembly, chrom, start, end)
+        self.select.update(insertions, screen_name, assembly, chrom, start,
+                           end)
+        self.transcript.update(refseq, assembly, chrom, start, end,
+                               gene_index=gene_index)
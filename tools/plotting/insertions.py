@@ -6,17 +6,144 @@ from typing import Optional
 from bokeh.plotting import figure
 from bokeh.models import (ColumnDataSource, HoverTool, CrosshairTool,
                           RangeTool, Range1d, LinearAxis, NumeralTickFormatter,
-                          Div, LabelSet)
+                          Div, LabelSet, Rect)
 from bokeh.palettes import PiYG8
-from bokeh.transform import jitter
+from bokeh.transform import jitter, linear_cmap
+
+from tools.metrics import metrics
 
 # from insertools.refseq import collapse_gene_refseq, get_exon_regions
 
 pd.options.mode.chained_assignment = None
 
+# Lane (y position) and color of insertions for each screen type. Keys are
+# built from the first character of the 'chan', 'strand' and 'replicate'
+# columns, eg. 'h+' for high channel insertions in the + strand.
+INS_LANES = {'ip': {'h+': 4.5, 'l+': 2, 'h-': 3.5, 'l-': 1},
+             'ip_strand': {'h': 2, 'l': 1},
+             'sl': {'4-': 1, '4+': 2, '3-': 4, '3+': 5, '2-': 7, '2+': 8,
+                    '1-': 10, '1+': 11}}
+INS_COLORS = {'ip': {'h+': '#f7b784', 'l+': '#3381bd',
+                     'h-': '#f7b784', 'l-': '#3381bd'},
+              'ip_strand': {'h': '#f7b784', 'l': '#3381bd'},
+              'sl': {f'{r}{s}': PiYG8[-1] if s == '+' else PiYG8[0]
+                     for r in range(1, 5) for s in '+-'}}
+
+
+def lane_mode(screen_type: str, strand: Optional[str] = None) -> str:
+    # Key of INS_LANES and INS_COLORS used for a screen type
+    if screen_type == 'ip' or screen_type == 'pa':
+        return 'ip_strand' if strand else 'ip'
+    elif screen_type == 'sl':
+        return 'sl'
+    raise ValueError(f'Unknown screen type: {screen_type}')
+
+
+def lane_columns(screen_type: str, strand: Optional[str] = None) -> list:
+    # Insertion columns whose first character forms the lane key
+    mode = lane_mode(screen_type, strand)
+    if mode == 'ip':
+        return ['chan', 'strand']
+    elif mode == 'ip_strand':
+        return ['chan']
+    return ['replicate', 'strand']
+
+
+def lane_codes(insertions: pd.DataFrame, screen_type: str,
+               strand: Optional[str] = None) -> tuple:
+    '''Returns an integer lane code per insertion and the list of lane keys
+    the codes refer to. Columns are factorized once, so the per-row work is
+    done by NumPy instead of Python lookups.
+    '''
+    keys = ['']
+    codes = np.zeros(len(insertions), dtype=np.intp)
+    for col in lane_columns(screen_type, strand):
+        col_codes, uniques = pd.factorize(insertions[col])
+        if (col_codes < 0).any():
+            raise ValueError(f'Missing values in insertion column {col}')
+        firsts = [str(u)[0] for u in uniques]
+        codes = codes * len(firsts) + col_codes
+        keys = [k + f for k in keys for f in firsts]
+
+    return codes, keys
+
+
+def lane_palette(screen_type: str, strand: Optional[str] = None) -> list:
+    # Colors of the lanes of a screen type, indexed by the lane codes of
+    # encode_insertions
+    mode = lane_mode(screen_type, strand)
+    return [INS_COLORS[mode][k] for k in INS_LANES[mode]]
+
+
+def lane_cmap(screen_type: str, strand: Optional[str] = None) -> dict:
+    # Glyph color mapping lane codes to lane_palette colors in the browser
+    palette = lane_palette(screen_type, strand)
+    return linear_cmap('lane', palette, -0.5, len(palette) - 0.5)
+
+
+def encode_insertions(insertions: pd.DataFrame, screen_type: str = 'ip',
+                      strand: Optional[str] = None) -> pd.DataFrame:
+    '''Returns a copy of insertions with the plotting columns 'lane' (int8
+    index of the lane in INS_LANES, its color is lane_palette()[lane]),
+    'ypos' and 'xpos'. Equivalent to looking up INS_LANES row by row, eg.
+    for 'ip' screens without strand:
+    chan    strand  pos     lane    ypos    xpos
+    high    +       5021987 0       4.5     5021987
+    low     -       5029782 3       1.0     5029782
+    '''
+    mode = lane_mode(screen_type, strand)
+    codes, keys = lane_codes(insertions, screen_type, strand)
+
+    lane_keys = list(INS_LANES[mode])
+    lanes = np.array([lane_keys.index(k) for k in keys], dtype=np.int8)
+    ypos = np.array([INS_LANES[mode][k] for k in keys], dtype=np.float32)
+
+    return insertions.assign(lane=lanes[codes], ypos=ypos[codes],
+                             xpos=insertions['pos'].values)
+
+
+def source_data(encoded: pd.DataFrame) -> dict:
+    # Columns of encoded insertions sent to the browser. Only numeric
+    # columns, colors are mapped from lanes by the glyphs (see lane_cmap).
+    return {'xpos': encoded['xpos'].values, 'ypos': encoded['ypos'].values,
+            'lane': encoded['lane'].values}
+
+
+def bin_insertions(insertions: pd.DataFrame, start: int, end: int,
+                   bins: int) -> pd.DataFrame:
+    '''Returns the number of encoded insertions (see encode_insertions) in
+    each lane for bins of equal width between start and end. Only non-empty
+    bins are returned. Eg.:
+    left        right       ypos    lane    count
+    5021000.0   5022000.0   4.5     0       12
+    5022000.0   5023000.0   4.5     0       3
+    '''
+    xpos = insertions['xpos'].values
+    in_range = (xpos >= start) & (xpos < end)
+    xpos = xpos[in_range]
+
+    lanes, lane_ids = pd.factorize(insertions['lane'].values[in_range])
+    lane_ypos = (insertions['ypos'].values[in_range]
+                 [np.unique(lanes, return_index=True)[1]])
+
+    bin_width = (end - start) / bins
+    bin_idx = ((xpos - start) // bin_width).astype(np.intp).clip(0, bins - 1)
+    counts = np.bincount(lanes * bins + bin_idx,
+                         minlength=len(lane_ids) * bins)
+
+    nonzero = np.flatnonzero(counts)
+    lane, bin_idx = np.divmod(nonzero, bins)
+    left = start + bin_idx * bin_width
+
+    return pd.DataFrame({'left': left, 'right': left + bin_width,
+                         'ypos': lane_ypos[lane],
+                         'lane': np.asarray(lane_ids)[lane],
+                         'count': counts[nonzero]})
+
 
 class InsertionPlot():
 
+    @metrics.timed('insertion_plot')
     def __init__(self, insertions: pd.DataFrame, screen_name: str,
                  assembly: str, chrom: str, start: int,
                  end: int, load_padd: Optional[int] = 300000,
@@ -24,7 +151,10 @@ class InsertionPlot():
                  jitter_ins: Optional[bool] = False,
                  plot_height: Optional[int] = None,
                  dashed_edges: Optional[bool] = True,
-                 strand: Optional[str] = None) -> None:
+                 strand: Optional[str] = None,
+                 source: Optional[ColumnDataSource] = None,
+                 lod_threshold: Optional[int] = None,
+                 lod_bins: Optional[int] = 300) -> None:
 
 
         self.load_padd = load_padd
@@ -40,6 +170,14 @@ class InsertionPlot():
         self.load_end = end + self.load_padd
         self.jitter = jitter_ins
 
+        # With lod_threshold, ranges wider than lod_threshold bp show binned
+        # insertion counts instead of individual insertions
+        self.lod_threshold = lod_threshold
+        self.lod_bins = lod_bins
+        self.owns_source = source is None
+        self.selection = False
+        self.updating = False
+
         # Set plot
         if self.screen_type == 'ip' or self.screen_type == 'pa':
             if self.strand:
@@ -102,10 +240,14 @@ class InsertionPlot():
                                                     10: 'replicate 1 -',
                                                     11: 'replicate 1 +'}
 
-        self.set_source()
+        # Reuse the source of another plot of the same insertions (eg. for the
+        # range selector) so its data is only sent to the browser once
+        self.source = source
+        self.set_data()
 
         # Plot insertions
         ins_line_color = '#BCBCBF'
+        ins_cmap = lane_cmap(self.screen_type, self.strand)
         x_line = (self.load_start, self.load_end)
         # print('aaa', self.plt.yaxis.ticker.ticks)
 
@@ -129,24 +271,37 @@ class InsertionPlot():
                               line_width=0, name='ins_line', alpha=0.2)
             self.plt.circle(x='xpos', y=jitter('ypos', width=0.75,
                                                range=self.plt.y_range),
-                            color='color', source=self.source,
+                            color=ins_cmap, source=self.source,
                             angle=pi/2, line_width=1, size=1.5,
                             name='insertions_dash')
         else:
             for y in self.plt.yaxis.ticker.ticks:
                 self.plt.line(x=x_line, y=[y, y], color=ins_line_color,
                               line_width=2, name='ins_line')
-            self.plt.dash(x='xpos', y='ypos', color='color',
+            self.plt.dash(x='xpos', y='ypos', color=ins_cmap,
                           source=self.source,
                           angle=pi/2, line_width=1, size=15,
                           name='insertions_dash')
 
+        # Plot binned insertion counts, their height within each lane is
+        # proportional to the count
+        if self.lod_threshold:
+            self.bin_source = ColumnDataSource(
+                {col: [] for col in ['left', 'right', 'bottom', 'top',
+                                     'lane', 'count']})
+            self.plt.quad(left='left', right='right', bottom='bottom',
+                          top='top', color=ins_cmap, source=self.bin_source,
+                          line_width=0, name='insertions_bins')
+            self.set_lod(self.plt.x_range.start, self.plt.x_range.end)
+            self.plt.x_range.on_change('start', self.update_lod)
+            self.plt.x_range.on_change('end', self.update_lod)
+
         # Plot dashed edges
         if dashed_edges:
             self.plt.line(x=(self.start, self.start), y=self.ylim,
-                          color='#E2E2E4', line_dash=[5, 2])
+                          color='#E2E2E4', line_dash=[5, 2], name='edges')
             self.plt.line(x=(self.end, self.end), y=self.ylim, color='#E2E2E4',
-                          line_dash=[5, 2])
+                          line_dash=[5, 2], name='edges')
 
         # Change title when x range changes
         # self.plt.x_range.on_change('start', self.update_title)
@@ -178,6 +333,73 @@ class InsertionPlot():
                             text_font_size='8pt', name='scale_bar_labels')
         self.plt.add_layout(labels)
 
+    def set_window_glyphs(self) -> None:
+        # Move glyphs drawn at the gene or loaded window limits (lanes, hover
+        # line, dashed edges and scale bar) to the current window
+
+        x_line = (self.load_start, self.load_end)
+        for renderer in self.plt.select(name='ins_line'):
+            if isinstance(renderer.glyph, Rect):
+                renderer.glyph.x = (x_line[1]-x_line[0])/2 + x_line[0]
+                renderer.glyph.width = x_line[1]-x_line[0]
+            else:
+                renderer.data_source.data['x'] = x_line
+        for renderer in self.plt.select(name='needshover'):
+            renderer.data_source.data['x'] = x_line
+
+        for renderer, x in zip(self.plt.select(name='edges'),
+                               (self.start, self.end)):
+            renderer.data_source.data['x'] = (x, x)
+
+        bar_size = max(1000, 10**int(np.log10(self.end - self.start) - 1))
+        for renderer in self.plt.select(name='scale_bar'):
+            renderer.glyph.x = self.start + bar_size/2
+            renderer.glyph.width = bar_size
+        for labels in self.plt.select(name='scale_bar_labels'):
+            labels.source.data.update(size=[f'{int(bar_size/1000)}kb'],
+                                      xpos=[self.start])
+
+    def update(self, insertions: pd.DataFrame, screen_name: str,
+               assembly: str, chrom: str, start: int, end: int) -> None:
+        '''Shows the insertions of another window, updating the data and
+        ranges of the existing plot, so that only these are sent to the
+        browser.
+        '''
+        self.insertions = insertions
+        self.screen = screen_name
+        self.assembly = assembly
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.load_start = start - self.load_padd
+        self.load_end = end + self.load_padd
+
+        # Range changes trigger update_lod, skip it until data is set
+        self.updating = True
+        self.set_data()
+        self.set_window_glyphs()
+
+        x_range = self.plt.x_range
+        bounds = (self.load_start, self.load_end)
+        if self.selection:
+            x_range.update(bounds=bounds, start=self.load_start,
+                           end=self.load_end)
+            self.plt.extra_x_ranges['relative_pos'].update(
+                start=-self.load_padd,
+                end=self.end - self.start + self.load_padd)
+        else:
+            margins = (self.load_end-self.load_start)/60
+            x_range.update(bounds=bounds, start=start - margins,
+                           end=end + margins)
+        self.updating = False
+
+        if self.selection and self.lod_threshold:
+            self.set_bins(self.load_start, self.load_end, self.lod_bins)
+        elif self.lod_threshold:
+            self.set_lod(x_range.start, x_range.end)
+
+        self.update_div_title('dummy', 'dummy', 'dummy')
+
     def update_title(self, attr, old, new):
 
         start = int(self.plt.x_range.start)
@@ -186,67 +408,145 @@ class InsertionPlot():
                                f'{self.assembly} at {self.chrom}:{start + 1:,}'
                                f' - {end:,} ({end-start+1:,} bp)')
 
-    def set_source(self) -> ColumnDataSource:
-        load_start = self.load_start
-        load_end = self.load_end
-        chrom = self.chrom
+    def encode(self, insertions: Optional[pd.DataFrame] = None
+               ) -> pd.DataFrame:
         strand = self.strand
+        insertions = self.insertions if insertions is None else insertions
 
         if self.strand:
-            # q_ins = self.insertions.query('chr == @chrom '
-            #                               '& pos >= @load_start '
-            #                               '& pos <= @load_end '
-            #                               '& strand == @strand')
-            q_ins = self.insertions.query('strand == @strand')
+            q_ins = insertions.query('strand == @strand')
         else:
-            # q_ins = self.insertions.query('chr == @chrom '
-            #                               '& pos >= @load_start '
-            #                               '& pos <= @load_end')
-            q_ins = self.insertions
-
-        if self.screen_type == 'ip' or self.screen_type == 'pa':
+            q_ins = insertions
 
-            # ins_colors = {'h+': PiYG8[0], 'l+': PiYG8[-1],
-            #               'h-': PiYG8[2], 'l-': PiYG8[-3]}
+        q_ins = encode_insertions(q_ins, screen_type=self.screen_type,
+                                  strand=self.strand)
 
-            if self.strand:
-                ins_colors = {'h': '#f7b784', 'l': '#3381bd'}
-                ins_pos = {'h': 2, 'l': 1}
-                q_ins['color'] = q_ins.apply(
-                    lambda x: ins_colors[x['chan'][0]],
-                    axis=1)
-                q_ins['ypos'] = q_ins.apply(
-                    lambda x: ins_pos[x['chan'][0]], axis=1)
-                q_ins['xpos'] = q_ins.apply(lambda x: x['pos'], axis=1)
-
-            else:
-                ins_colors = {'h+': '#f7b784', 'l+': '#3381bd',
-                              'h-': '#f7b784', 'l-': '#3381bd'}
-                ins_pos = {'h+': 4.5, 'l+': 2,
-                           'h-': 3.5, 'l-': 1}
-                q_ins['color'] = q_ins.apply(
-                    lambda x: ins_colors[x['chan'][0] + x['strand'][0]],
-                    axis=1)
-                q_ins['ypos'] = q_ins.apply(
-                    lambda x: ins_pos[x['chan'][0] + x['strand'][0]], axis=1)
-                q_ins['xpos'] = q_ins.apply(lambda x: x['pos'], axis=1)
-
-        elif self.screen_type == 'sl':
+        # Only the plotting columns are kept
+        return q_ins[['xpos', 'ypos', 'lane']]
 
-            ins_colors = {'+': PiYG8[-1], '-': PiYG8[0]}
-            ins_pos = {'4-': 1, '4+': 2, '3-': 4, '3+': 5, '2-': 7, '2+': 8,
-                       '1-': 10, '1+': 11}
+    @metrics.timed('set_source')
+    def set_source(self) -> ColumnDataSource:
 
-            q_ins['color'] = q_ins.apply(
-                lambda x: ins_colors[x['strand'][0]], axis=1)
-            q_ins['ypos'] = q_ins.apply(
-                lambda x: ins_pos[str(x['replicate'][0]) + x['strand'][0]],
-                axis=1)
-            q_ins['xpos'] = q_ins.apply(lambda x: x['pos'], axis=1)
+        q_ins = self.encode()
 
-        source_ins = ColumnDataSource(q_ins)
+        if self.lod_threshold:
+            # Insertions are sent to the browser by set_lod when zoomed in
+            self.encoded = q_ins.sort_values('xpos', kind='stable')
+            q_ins = q_ins.iloc[:0]
+            if self.source is not None:
+                return
 
-        self.source = source_ins
+        if self.source is None:
+            self.source = ColumnDataSource(source_data(q_ins))
+        else:
+            self.source.data = source_data(q_ins)
+
+    def set_data(self) -> None:
+        # Set source data, or only the encoded insertions used for binned
+        # counts if the source belongs to another plot
+        if self.owns_source:
+            self.set_source()
+        elif self.lod_threshold:
+            self.encoded = self.encode()
+
+    def set_lod(self, start: float, end: float) -> None:
+        # Show insertions or binned counts for the range start-end. Data is
+        # set for one range width at each side, so small pans and zooms do not
+        # need new data.
+        width = end - start
+        span = (max(start - width, self.load_start),
+                min(end + width, self.load_end))
+        binned = width > self.lod_threshold
+
+        if binned:
+            self.set_bins(span[0], span[1],
+                          int(self.lod_bins * (span[1] - span[0]) / width))
+        elif self.owns_source:
+            xpos = self.encoded['xpos'].values
+            lims = (np.searchsorted(xpos, span[0], side='left'),
+                    np.searchsorted(xpos, span[1], side='right'))
+            self.source.data = source_data(
+                self.encoded.iloc[lims[0]:lims[1]])
+
+        self.plt.select(name='insertions_dash').visible = not binned
+        self.plt.select(name='insertions_bins').visible = binned
+
+        self.lod_span = span
+        self.lod_width = width
+        self.lod_binned = binned
+
+    def set_bins(self, start: float, end: float, bins: int) -> None:
+
+        bins = bin_insertions(self.encoded, start, end, bins)
+        bins['bottom'] = bins['ypos'] - 0.4
+        bins['top'] = (bins['bottom'] + 0.8 * bins['count']
+                       / np.max(bins['count'].values, initial=1))
+
+        self.bin_source.data = dict(ColumnDataSource.from_df(bins))
+
+    def update_lod(self, attr, old, new):
+
+        if self.updating:
+            return
+
+        start = self.plt.x_range.start
+        end = self.plt.x_range.end
+        width = end - start
+
+        binned = width > self.lod_threshold
+        in_span = self.lod_span[0] <= start and end <= self.lod_span[1]
+        # Bins are recomputed when zooming changes their width too much
+        same_zoom = not binned or 0.5 < width / self.lod_width < 2
+
+        if binned != self.lod_binned or not in_span or not same_zoom:
+            self.set_lod(start, end)
+
+    def extend(self, insertions: pd.DataFrame, load_start: int,
+               load_end: int) -> None:
+        '''Adds insertions loaded for load_start-load_end, a region flanking
+        the loaded window, streaming them to the browser, and widens the
+        x range bounds to the new loaded window.
+        '''
+        encoded = self.encode(insertions)
+
+        self.insertions = pd.concat([self.insertions, insertions],
+                                    ignore_index=True)
+        self.load_start = min(self.load_start, load_start)
+        self.load_end = max(self.load_end, load_end)
+        self.plt.x_range.bounds = (self.load_start, self.load_end)
+
+        # Widen lane backgrounds and hover line to the loaded window
+        self.set_window_glyphs()
+
+        if self.selection:
+            self.plt.x_range.start = self.load_start
+            self.plt.x_range.end = self.load_end
+            self.plt.extra_x_ranges['relative_pos'].update(
+                start=self.load_start - self.start,
+                end=self.load_end - self.start)
+
+        if not self.lod_threshold:
+            if self.owns_source:
+                self.source.stream(source_data(encoded))
+            return
+
+        self.encoded = pd.concat([self.encoded, encoded]).sort_values(
+            'xpos', kind='stable')
+
+        if self.selection:
+            self.set_bins(self.load_start, self.load_end, self.lod_bins)
+        elif self.lod_binned or not self.owns_source:
+            self.set_lod(self.plt.x_range.start, self.plt.x_range.end)
+        else:
+            # Stream the new insertions falling in the widened data span
+            start = self.plt.x_range.start
+            end = self.plt.x_range.end
+            width = end - start
+            span = (max(start - width, self.load_start),
+                    min(end + width, self.load_end))
+            in_span = encoded.query('xpos >= @span[0] & xpos <= @span[1]')
+            self.source.stream(source_data(in_span))
+            self.lod_span = span
 
     def hide_tools(self) -> None:
         self.plt.toolbar_location = None
@@ -270,6 +570,7 @@ class InsertionPlot():
         # Use self plot for selecting x ranges of other_plot
 
         padd = padd or self.load_padd
+        self.selection = True
 
         margins = (self.load_end-self.load_start)/60
 
@@ -296,6 +597,11 @@ class InsertionPlot():
         self.plt.xaxis.formatter = NumeralTickFormatter(format='0,0')
         self.plt.yaxis.visible = False
 
+        if self.lod_threshold:
+            self.set_bins(self.load_start, self.load_end, self.lod_bins)
+            self.plt.select(name='insertions_dash').visible = False
+            self.plt.select(name='insertions_bins').visible = True
+
         if self.jitter:
             ins_glyph = self.plt.select(name='insertions_dash')
             ins_glyph.glyph.size = 0.5
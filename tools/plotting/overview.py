@@ -0,0 +1,142 @@
+import re
+import pandas as pd
+import numpy as np
+from typing import Callable, Optional
+from bokeh.plotting import figure
+from bokeh.models import (BoxAnnotation, ColumnDataSource, FixedTicker,
+                          HoverTool, NumeralTickFormatter, Range1d, TapTool)
+
+from tools.plotting.insertions import INS_COLORS
+
+
+def chrom_key(chrom: str) -> tuple:
+    # Sort key of chromosome names, eg. chr2 before chr10 before chrX
+    name = re.sub('^chr', '', chrom)
+    return (0, int(name), '') if name.isdigit() else (1, 0, name)
+
+
+class OverviewPlot():
+    '''Insertion density of all chromosomes of a screen, from the genome
+    density table (see tools.build_density), with high channel counts above
+    and low channel counts below the axis. Chromosomes are placed one after
+    another, and tapping a bin calls on_select(chrom, start, end) with its
+    region.
+    '''
+
+    def __init__(self, density: pd.DataFrame, screen_name: str,
+                 assembly: str,
+                 on_select: Optional[Callable] = None) -> None:
+
+        self.on_select = on_select
+        self.source = ColumnDataSource()
+        self.band_source = ColumnDataSource()
+
+        self.plt = figure(plot_width=1000, plot_height=120,
+                          x_range=Range1d(0, 1), min_border_left=70,
+                          min_border_right=10,
+                          tools='reset, xpan, xwheel_zoom, tap',
+                          active_scroll='xwheel_zoom', active_drag='xpan')
+        self.plt.ygrid.grid_line_color = None
+        self.plt.xgrid.grid_line_color = None
+        self.plt.outline_line_color = None
+        self.plt.toolbar.logo = None
+        self.plt.toolbar_location = None
+        self.plt.xaxis.major_tick_line_color = None
+        self.plt.xaxis.minor_tick_line_color = None
+        self.plt.xaxis.major_label_text_font_size = '7pt'
+        self.plt.yaxis.formatter = NumeralTickFormatter(format='0a')
+        self.plt.yaxis.minor_tick_line_color = None
+
+        # Alternating chromosome backgrounds
+        self.plt.extra_y_ranges = {'bands': Range1d(0, 1)}
+        self.plt.quad(left='left', right='right', bottom=0, top=1,
+                      y_range_name='bands', source=self.band_source,
+                      fill_color='#F2F2F4', fill_alpha='alpha',
+                      line_width=0)
+
+        high = self.plt.quad(left='left', right='right', bottom=0,
+                             top='high', source=self.source,
+                             color=INS_COLORS['ip_strand']['h'],
+                             line_width=0, name='density')
+        low = self.plt.quad(left='left', right='right', bottom='low',
+                            top=0, source=self.source,
+                            color=INS_COLORS['ip_strand']['l'],
+                            line_width=0, name='density')
+        for renderer in (high, low):
+            renderer.nonselection_glyph = None
+            renderer.selection_glyph = None
+
+        self.plt.select_one(TapTool).renderers = [high, low]
+        self.plt.add_tools(HoverTool(
+            tooltips=[('Region', '@chrom:@start{0,0}-@end{0,0}'),
+                      ('High', '@high{0,0}'),
+                      ('Low', '@low_count{0,0}')],
+            names=['density']))
+
+        # Window shown by the other plots
+        self.window = BoxAnnotation(fill_color='navy', fill_alpha=0.2,
+                                    line_color='navy', line_alpha=0.6,
+                                    visible=False)
+        self.plt.add_layout(self.window)
+
+        self.update(density, screen_name, assembly)
+        self.source.selected.on_change('indices', self.select)
+
+    def update(self, density: pd.DataFrame, screen_name: str,
+               assembly: str) -> None:
+        # Show the density of another screen or assembly
+
+        self.screen = screen_name
+        self.assembly = assembly
+
+        chroms = sorted(density['chrom'].unique(), key=chrom_key)
+        lengths = density.groupby('chrom')['end'].max()[chroms].values
+        self.offsets = dict(zip(chroms, (np.cumsum(lengths)
+                                         - lengths).tolist()))
+        genome_length = int(lengths.sum()) if len(chroms) else 1
+
+        offset = density['chrom'].map(self.offsets).values
+        high = density.filter(like='high').sum(axis=1).values
+        low = density.filter(like='low').sum(axis=1).values
+        self.source.data = {'left': offset + density['start'].values,
+                            'right': offset + density['end'].values,
+                            'chrom': density['chrom'].values,
+                            'start': density['start'].values,
+                            'end': density['end'].values,
+                            'high': high, 'low': -low, 'low_count': low}
+
+        starts = np.cumsum(lengths) - lengths
+        self.band_source.data = {'left': starts, 'right': starts + lengths,
+                                 'alpha': np.arange(len(chroms)) % 2 * 1.0}
+
+        centers = (starts + lengths / 2).tolist()
+        self.plt.xaxis.ticker = FixedTicker(ticks=centers)
+        self.plt.xaxis.major_label_overrides = {
+            c: re.sub('^chr', '', chrom) for c, chrom in zip(centers,
+                                                              chroms)}
+        self.plt.x_range.update(start=0, end=genome_length,
+                                bounds=(0, genome_length))
+        self.plt.title.text = (f'Insertion density of screen {screen_name} - '
+                               f'{assembly}')
+
+    def show_window(self, chrom: str, start: int, end: int) -> None:
+        # Highlight the window shown by the other plots
+        if chrom not in self.offsets:
+            self.window.visible = False
+            return
+
+        offset = self.offsets[chrom]
+        self.window.update(left=offset + start, right=offset + end,
+                           visible=True)
+
+    def select(self, attr, old, new):
+
+        if not new:
+            return
+        idx = new[0]
+        self.source.selected.indices = []
+
+        if self.on_select is not None:
+            data = self.source.data
+            self.on_select(data['chrom'][idx], int(data['start'][idx]),
+                           int(data['end'][idx]))
@@ -7,7 +7,37 @@ from bokeh.models import (ColumnDataSource, HoverTool, Range1d,
                           NumeralTickFormatter, LabelSet, Arrow, NormalHead,
                           Title, CrosshairTool)
 
-from tools.refseq import collapse_gene_refseq, get_exon_regions
+from tools.load_data import load_exon_regions
+from tools.metrics import metrics
+from tools.refseq import GeneIntervalIndex, get_exon_regions
+
+
+def window_exons(transcripts: pd.DataFrame, chrom: str, assembly: str,
+                 data_path: Optional[str] = None) -> pd.DataFrame:
+    # Exon regions of transcripts with columns name2, name, reg_type, start
+    # and end. Read from the exon region table (see
+    # tools.build_exon_regions) when data_path is given, or computed from
+    # the transcripts otherwise.
+
+    if len(transcripts) == 0:
+        return pd.DataFrame(columns=['name2', 'name', 'reg_type', 'start',
+                                     'end'])
+
+    if data_path is not None:
+        try:
+            exons = load_exon_regions(data_path, chrom,
+                                      transcripts.txStart.min(),
+                                      transcripts.txEnd.max(),
+                                      assembly=assembly)
+            return exons[exons['name'].isin(transcripts['name'].values)]
+        except OSError:
+            pass
+
+    exons = get_exon_regions(transcripts, by='name_chrom')
+    exons['start'] = exons['reg_lims'].str[0]
+    exons['end'] = exons['reg_lims'].str[1]
+
+    return exons
 
 
 class TranscriptPlot():
@@ -17,9 +47,13 @@ class TranscriptPlot():
                  load_padd: Optional[int] = 300000,
                  dashed_edges: Optional[bool] = True,
                  load_gene: Optional[str] = None,
-                 x_axis: Optional[bool] = True) -> None:
+                 x_axis: Optional[bool] = True,
+                 gene_index: Optional[GeneIntervalIndex] = None,
+                 data_path: Optional[str] = None) -> None:
 
         self.refseq = refseq
+        self.gene_index = gene_index
+        self.data_path = data_path
         self.assembly = assembly
         self.chrom = chrom
         self.start = start
@@ -30,6 +64,7 @@ class TranscriptPlot():
         self.load_end = end + self.load_padd
 
         self.load_gene = load_gene
+        self.linked = False
 
         self.transcripts = self.load_transcripts()
         self.exons = self.load_exons()
@@ -74,12 +109,24 @@ class TranscriptPlot():
         # Plot dashed edges at start and end
         if dashed_edges:
             self.plt.line(x=(self.start, self.start), y=self.ylim,
-                          color='#E2E2E4', line_dash=[5, 2])
+                          color='#E2E2E4', line_dash=[5, 2], name='edges')
             self.plt.line(x=(self.end, self.end), y=self.ylim, color='#E2E2E4',
-                          line_dash=[5, 2])
-
-        # Plot transcript lines
-        self.transcripts.apply(self.plot_tx_line, axis=1)
+                          line_dash=[5, 2], name='edges')
+
+        # Each track element is drawn by a single renderer, with one row per
+        # transcript or exon in its source
+        self.tx_sources = {coding: ColumnDataSource(self.tx_line_data(coding))
+                           for coding in (True, False)}
+        self.exon_source = ColumnDataSource(self.exon_data())
+        self.arrow_source = ColumnDataSource(self.arrow_data())
+        self.label_source = ColumnDataSource(self.label_data())
+
+        # Plot transcript lines, dashed for non-coding transcripts
+        for coding, dash in ((True, 'solid'), (False, '3 1')):
+            self.plt.multi_line(xs='xs', ys='ys',
+                                source=self.tx_sources[coding],
+                                line_dash=dash, line_color='color',
+                                line_width=1, name='tx_line')
         self.plt.add_tools(HoverTool(tooltips=[('Gene', '@name_chrom'),
                                                ('Transcript', '@name'),
                                                ('Strand', '@strand'),
@@ -92,9 +139,17 @@ class TranscriptPlot():
                                      names=['tx_line']))
 
         # Plot exons
-        self.exons.apply(self.plot_exon, axis=1)
-
-        self.transcripts.apply(self.plot_tx_arrow, axis=1)
+        self.plt.patches(xs='xs', ys='ys', color='color',
+                         source=self.exon_source, name='exons')
+
+        # Plot strand arrows and gene names
+        self.plt.triangle(x='xpos', y='ypos', angle='angle', size=6,
+                          line_color='#636e72', fill_color='#636e72',
+                          source=self.arrow_source, name='tx_arrow')
+        labels = LabelSet(x='xpos', y='ypos', text='name_chrom',
+                          x_offset=4, y_offset=2, source=self.label_source,
+                          text_font_size='8pt', name='tx_labels')
+        self.plt.add_layout(labels)
 
         # self.plot_scale_bar()
 
@@ -113,71 +168,69 @@ class TranscriptPlot():
                             text_font_size='8pt')
         self.plt.add_layout(labels)
 
-    def plot_exon_rect(self, ex):
-
-        # Generate data source
-        ex_df = pd.DataFrame()
-        ex_df['ypos'] = (self.transcripts.tx_id[self.transcripts['name']
-                                                == ex['name']])
-        ex_df['width'] = ex.reg_lims[1] - ex.reg_lims[0]
-        ex_df['xpos'] = ex.reg_lims[0] + ex_df['width']/2 - 0.5
-
-        # ex_df['color'] = '#fdae61' if ex.reg_type == 'exCds' else '#3288bd'
-        # ex_df['height'] = 0.8 if ex.reg_type == 'exCds' else 0.5
-        ex_df['color'] = 'red' if ex.reg_type == 'exCds' else 'red'
-        ex_df['height'] = 1 if ex.reg_type == 'exCds' else 0.8
-
-        ex_source = ColumnDataSource(ex_df)
-
-        self.plt.rect(x='xpos', y='ypos', width='width', height='height',
-                      color='color', source=ex_source)
-
-    def plot_exon(self, ex):
-        ex_df = pd.DataFrame()
-        y_center = (self.transcripts.tx_id[self.transcripts['name']
-                                           == ex['name']])
-        y_off = 0.3 if ex.reg_type == 'exCds' else 0.15
-        ex_df['ypos'] = [y_center + y_off, y_center - y_off,
-                         y_center - y_off, y_center + y_off]
-        ex_df['xpos'] = [ex.reg_lims[0] - 0.5, ex.reg_lims[0] - 0.5,
-                         ex.reg_lims[1] - 0.5, ex.reg_lims[1] - 0.5]
-        # ex_color = '#fdae61' if ex.reg_type == 'exCds' else '#3288bd'
-
-        ex_color = '#e58e26' if ex.reg_type == 'exCds' else '#0c2461'
-
-        ex_source = ColumnDataSource(ex_df)
-
-        self.plt.patch(x='xpos', y='ypos', color=ex_color, source=ex_source)
-
     def hide_tools(self) -> None:
         self.plt.toolbar_location = None
 
-    def load_exons(self) -> pd.DataFrame:
+    def update(self, refseq: pd.DataFrame, assembly: str, chrom: str,
+               start: int, end: int,
+               gene_index: Optional[GeneIntervalIndex] = None) -> None:
+        '''Shows the transcripts of another window, updating the sources and
+        ranges of the existing plot instead of creating new renderers.
+        '''
+        self.refseq = refseq
+        self.gene_index = gene_index
+        self.assembly = assembly
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.load_start = start - self.load_padd
+        self.load_end = end + self.load_padd
 
-        exons = (self.transcripts.groupby('name_chrom')
-                 .apply(get_exon_regions).reset_index(drop=True))
+        self.transcripts = self.load_transcripts()
+        self.exons = self.load_exons()
 
-        return exons
+        for coding, source in self.tx_sources.items():
+            source.data = self.tx_line_data(coding)
+        self.exon_source.data = self.exon_data()
+        self.arrow_source.data = self.arrow_data()
+        self.label_source.data = self.label_data()
 
+        self.ylim = (0.5, len(self.transcripts) + 0.8)
+        self.plt.y_range.update(start=self.ylim[0], end=self.ylim[1])
+        self.plt.frame_height = (len(self.transcripts))*15
+
+        for renderer, x in zip(self.plt.select(name='edges'),
+                               (self.start, self.end)):
+            renderer.data_source.data = {'x': [x, x], 'y': list(self.ylim)}
+        for renderer in self.plt.select(name='needshover'):
+            renderer.data_source.data['x'] = [self.load_start, self.load_end]
+
+        # The x range of linked plots is updated by the insertion plot
+        if not self.linked:
+            self.plt.x_range.update(bounds=(self.load_start, self.load_end),
+                                    start=start-(end-start)/60,
+                                    end=end+(end-start)/60)
+
+    @metrics.timed('load_exons')
+    def load_exons(self) -> pd.DataFrame:
+        return window_exons(self.transcripts, self.chrom, self.assembly,
+                            data_path=self.data_path)
+
+    @metrics.timed('load_transcripts')
     def load_transcripts(self) -> pd.DataFrame:
 
         chrom = self.chrom
-        chrom_refseq = self.refseq.query('chrom == @chrom')
-        coll_refseq = chrom_refseq.groupby(
-            'name_chrom').apply(collapse_gene_refseq)
 
-        load_start = self.load_start
-        load_end = self.load_end
         if self.load_gene is None:
-            load_genes = coll_refseq.query('(txEnd >= @load_start '
-                                           '& txEnd <= @load_end) |'
-                                           '(txStart >= @load_start '
-                                           '& txStart <= @load_end) |'
-                                           '(txStart <= @load_start '
-                                           '& txEnd >= @load_end)').index
-            q_refseq = chrom_refseq.query('name_chrom in @load_genes')
+            # Genes overlapping the loaded window
+            if self.gene_index is None:
+                self.gene_index = GeneIntervalIndex(
+                    self.refseq.query('chrom == @chrom'))
+            q_refseq = self.gene_index.transcripts(chrom, self.load_start,
+                                                   self.load_end)
         else:
-            q_refseq = chrom_refseq.query('name_chrom == @self.load_gene')
+            q_refseq = self.refseq.query('chrom == @chrom '
+                                         '& name_chrom == @self.load_gene')
 
         q_refseq = q_refseq.sort_values(by='name_chrom')
         q_refseq['tx_id'] = q_refseq.reset_index().index + 1
@@ -186,67 +239,73 @@ class TranscriptPlot():
 
         return q_refseq
 
-    def plot_tx_line(self, tx) -> None:
-
-        # Generate data source
-        tx_df = pd.DataFrame()
-        # tx_df = dict()
-
-        # tx_df['xpos'] = [tx.txStart - 0.5, tx.txEnd - 0.5]
-        if tx['strand'] == '-':
-            tx_df['xpos'] = [tx.txStart - (self.end-self.start)/120,
-                             tx.txEnd + 0.5]
-        else:
-            tx_df['xpos'] = [tx.txStart - 0.5,
-                             tx.txEnd + (self.end-self.start)/120]
-
-        tx_df['ypos'] = [tx.tx_id, tx.tx_id]
-        tx_df['name'] = [tx['name'], tx['name']]
-        tx_df['name_chrom'] = [tx.name_chrom, tx.name_chrom]
-        tx_df['length'] = [tx.txEnd - tx.txStart, tx.txEnd - tx.txStart]
-        tx_df['coding'] = [tx.coding, tx.coding]
-        tx_df['known'] = [tx.known, tx.known]
-        tx_df['strand'] = [tx.strand, tx.strand]
-        tx_df['start'] = [tx.txStart, tx.txStart]
-        tx_df['end'] = [tx.txEnd, tx.txEnd]
-
-        dash = 'solid' if tx.coding else [3, 1]
-        tx_line_color = '#BCBCBF' if tx.known else '#B2D1F0'
-
-        tx_source = ColumnDataSource(tx_df)
-
-        # Plot line
-        self.plt.line(x='xpos', y='ypos', source=tx_source, line_dash=dash,
-                      line_color=tx_line_color, line_width=1, name='tx_line')
-
-    def plot_tx_arrow(self, tx):
-
-        if tx['strand'] == '-':
-            x_trian = tx['txStart'] - (self.end-self.start)/120
-            angle = pi/2
-            label_offset = 4
-        else:
-            x_trian = tx['txEnd'] + (self.end-self.start)/120
-            angle = -pi/2
-
-        self.plt.triangle(x=[x_trian], y=[tx['tx_id']], angle=angle, size=6,
-                          line_color='#636e72', fill_color='#636e72')
-
-        # Add gene name as label at end of line
-        if self.load_gene is None:
-            lbl_dict = {'name_chrom': [tx.name_chrom],
-                        'xpos': [tx.txEnd - 0.5],
-                        'ypos': [tx.tx_id]}
-            lbl_source = ColumnDataSource(lbl_dict)
-            labels = LabelSet(x='xpos', y='ypos', text='name_chrom',
-                              x_offset=4, y_offset=2, 
-                              source=lbl_source,
-                              text_font_size='8pt')
-            self.plt.add_layout(labels)
+    def tx_line_data(self, coding: bool) -> dict:
+        # Lines of coding or non-coding transcripts, extended at their 3' end
+        # to the strand arrow
+        tx = self.transcripts[self.transcripts['coding'] == coding]
+        arrow_offset = (self.end-self.start)/120
+        minus = (tx['strand'] == '-').values
+
+        x_start = np.where(minus, tx['txStart'] - arrow_offset,
+                           tx['txStart'] - 0.5)
+        x_end = np.where(minus, tx['txEnd'] + 0.5,
+                         tx['txEnd'] + arrow_offset)
+
+        return {'xs': np.stack([x_start, x_end], axis=1).tolist(),
+                'ys': np.stack([tx['tx_id'], tx['tx_id']], axis=1).tolist(),
+                'name': tx['name'].values,
+                'name_chrom': tx['name_chrom'].values,
+                'length': (tx['txEnd'] - tx['txStart']).values,
+                'coding': tx['coding'].values,
+                'known': tx['known'].values,
+                'strand': tx['strand'].values,
+                'start': tx['txStart'].values,
+                'end': tx['txEnd'].values,
+                'color': np.where(tx['known'], '#BCBCBF', '#B2D1F0')}
+
+    def exon_data(self) -> dict:
+        # Exon regions as patches at the height of their transcript, cds
+        # regions taller than utr regions
+        ex = self.exons[['name', 'reg_type', 'start', 'end']].merge(
+            self.transcripts[['name', 'tx_id']], on='name')
+        cds = (ex['reg_type'] == 'exCds').values
+        y_off = np.where(cds, 0.3, 0.15)
+        y_center = ex['tx_id'].values
+        x_start = ex['start'].values - 0.5
+        x_end = ex['end'].values - 0.5
+
+        return {'xs': np.stack([x_start, x_start, x_end, x_end],
+                               axis=1).tolist(),
+                'ys': np.stack([y_center + y_off, y_center - y_off,
+                                y_center - y_off, y_center + y_off],
+                               axis=1).tolist(),
+                'color': np.where(cds, '#e58e26', '#0c2461')}
+
+    def arrow_data(self) -> dict:
+        # Triangles pointing in the transcript direction at its 3' end
+        tx = self.transcripts
+        arrow_offset = (self.end-self.start)/120
+        minus = (tx['strand'] == '-').values
+
+        return {'xpos': np.where(minus, tx['txStart'] - arrow_offset,
+                                 tx['txEnd'] + arrow_offset),
+                'ypos': tx['tx_id'].values,
+                'angle': np.where(minus, pi/2, -pi/2)}
+
+    def label_data(self) -> dict:
+        # Gene names at the end of transcript lines
+        tx = self.transcripts
+        if self.load_gene is not None:
+            tx = tx.iloc[:0]
+
+        return {'name_chrom': tx['name_chrom'].values,
+                'xpos': tx['txEnd'].values - 0.5,
+                'ypos': tx['tx_id'].values}
 
     def link_ins(self, ins_plot) -> None:
 
         self.plt.x_range = ins_plot.x_range
+        self.linked = True
         self.plt.xaxis.visible = False
         self.plt.margin = (0, 0, 40, 0)
         self.plt.add_tools(ins_plot.tools[5])
@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
+
+from tools.load_data import (InsertionCache, get_gene_index,
+                             get_gene_symbols, insertion_cache,
+                             load_insertions)
+
+
+class Prefetcher():
+    '''Loads insertion windows a session is likely to show next into the
+    insertion cache, in a few background threads. Prefetching stops while
+    the cache holds more than max_bytes, so that it does not evict windows
+    sessions are showing, and is disabled with max_workers 0.
+
+    Sessions call claim with every window they load: it waits for a
+    prefetch of the window still in flight and counts how many loads were
+    answered by prefetched windows (stats). A prefetched window counts once,
+    later loads of it would have been answered by the cache anyway.
+    '''
+
+    def __init__(self, max_workers: int, max_bytes: int,
+                 cache: Optional[InsertionCache] = insertion_cache,
+                 max_windows: Optional[int] = 1000) -> None:
+        self.executor = None
+        if max_workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                               thread_name_prefix='prefetch')
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.max_windows = max_windows
+
+        # Windows in flight (futures) and prefetched, by
+        # (data_path, screen_name, assembly, chrom, start, end)
+        self.pending = {}
+        self.prefetched = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.submitted = 0
+        self.skipped = 0
+        self.loads = 0
+        self.hits = 0
+
+    def submit(self, data_path: str, screen_name: str, assembly: str,
+               chrom: str, start: int, end: int) -> bool:
+        # Schedules a window unless it is cached, in flight or over budget
+        key = (data_path, screen_name, assembly, chrom, start, end)
+        with self.lock:
+            if (self.executor is None or key in self.pending
+                    or self.cache.stats()['bytes'] >= self.max_bytes
+                    or self.cache.contains(*key)):
+                self.skipped += 1
+                return False
+            self.pending[key] = self.executor.submit(self.load, key)
+            self.submitted += 1
+
+        return True
+
+    def load(self, key: tuple) -> None:
+        data_path, screen_name, assembly, chrom, start, end = key
+        loaded = False
+        try:
+            load_insertions(data_path, screen_name, chrom, start, end,
+                            assembly=assembly)
+            loaded = True
+        except OSError:
+            pass
+        finally:
+            # Marked prefetched as it leaves pending, so claim sees it in
+            # one or the other
+            with self.lock:
+                self.pending.pop(key, None)
+                if loaded:
+                    self.prefetched[key] = True
+                if len(self.prefetched) > self.max_windows:
+                    self.prefetched.popitem(last=False)
+
+    def claim(self, data_path: str, screen_name: str, assembly: str,
+              chrom: str, start: int, end: int) -> None:
+        # Called before a session loads start-end
+
+        def covers(key):
+            return (key[:4] == (data_path, screen_name, assembly, chrom)
+                    and key[4] <= start and end <= key[5])
+
+        with self.lock:
+            futures = [f for key, f in self.pending.items() if covers(key)]
+        wait(futures)
+
+        with self.lock:
+            self.loads += 1
+            for key in self.prefetched:
+                if covers(key) and self.cache.contains(*key):
+                    del self.prefetched[key]
+                    self.hits += 1
+                    break
+
+    def prefetch_locus(self, data_path: str, screen_name: str,
+                       assembly: str, chrom: str, start: int, end: int,
+                       padd: int, screens: list,
+                       assemblies: Optional[list] = None,
+                       gene: Optional[str] = None) -> None:
+        '''Prefetches, around the shown window start-end (without padd):
+        the same window of the other screens, the windows of the genes
+        starting before and after it and, for genes, the window of the gene
+        in the other assemblies.
+        '''
+        if self.executor is None:
+            return
+        self.executor.submit(self.plan_locus, data_path, screen_name,
+                             assembly, chrom, start, end, padd, screens,
+                             assemblies or [], gene)
+
+    def plan_locus(self, data_path, screen_name, assembly, chrom, start, end,
+                   padd, screens, assemblies, gene) -> None:
+        # Runs in the prefetch threads, as finding the windows may read
+        # gene annotations
+
+        for other in screens:
+            if other != screen_name:
+                self.submit(data_path, other, assembly, chrom, start-padd,
+                            end+padd)
+
+        gene_index = get_gene_index(data_path, assembly=assembly)
+        for _, gene_start, gene_end in gene_index.adjacent(chrom, start):
+            self.submit(data_path, screen_name, assembly, chrom,
+                        gene_start-padd, gene_end+padd)
+
+        if gene is None:
+            return
+        for other in assemblies:
+            if other == assembly:
+                continue
+            try:
+                span = get_gene_symbols(data_path, assembly=other).lookup(gene)
+            except OSError:
+                continue
+            if span is None:
+                continue
+            gene_chrom, gene_start, gene_end = span
+            self.submit(data_path, screen_name, other, gene_chrom,
+                        gene_start-padd, gene_end+padd)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'submitted': self.submitted, 'skipped': self.skipped,
+                    'pending': len(self.pending), 'loads': self.loads,
+                    'hits': self.hits,
+                    'hit_rate': self.hits / self.loads if self.loads else 0}
+
+
+prefetcher = Prefetcher(
+    max_workers=int(os.environ.get('PREFETCH_THREADS', 2)),
+    max_bytes=int(os.environ.get('PREFETCH_CACHE_MB', 384)) * 2**20)
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 from itertools import groupby
 from operator import itemgetter
 from typing import Optional
@@ -96,6 +97,217 @@ def collapse_gene_refseq(gene_refseq, outer_cds=True, mode='first-last'):
     return gene_pos
 
 
+def cds_lengths(refseq: pd.DataFrame) -> tuple:
+    # Cds length of each transcript (sum of the parts of its exons between
+    # cdsStart and cdsEnd) and whether it has exons
+    starts = refseq['exonStarts'].str.split(',').explode()
+    ends = refseq['exonEnds'].str.split(',').explode()
+    keep = ((starts != '') & (ends != '')).values
+    row = np.repeat(np.arange(len(refseq)),
+                    refseq['exonStarts'].str.count(',').values + 1)[keep]
+
+    ex_start = starts.values[keep].astype(np.int64)
+    ex_end = ends.values[keep].astype(np.int64)
+    overlap = (np.minimum(ex_end, refseq['cdsEnd'].values[row])
+               - np.maximum(ex_start, refseq['cdsStart'].values[row]))
+
+    lengths = np.bincount(row, weights=np.maximum(overlap, 0),
+                          minlength=len(refseq)).astype(np.int64)
+    has_exons = np.bincount(row, minlength=len(refseq)) > 0
+
+    return lengths, has_exons
+
+
+def collapse_refseq(refseq: pd.DataFrame, by: str = 'name_chrom',
+                    outer_cds: bool = True,
+                    mode: str = 'first-last') -> pd.DataFrame:
+    '''Collapses the transcripts of all genes at once, as
+    refseq.groupby(by).apply(collapse_gene_refseq, outer_cds, mode) does
+    gene by gene. Mode first-last returns one row per gene indexed by by,
+    eg.:
+    name_chrom  gene    chrom   txStart     cdsStart    txEnd   ...
+    JAK2        JAK2    chr9    4985032     5021986     5128183 ...
+
+    Mode longest-cds returns the transcript(s) with the longest cds of each
+    gene, indexed by by and gene. Among transcripts with equally long cds,
+    the one with the most upstream cds start (first cdsStart for + strand
+    genes, last cdsEnd for - strand genes) is taken, the first in refseq
+    order if still tied. Genes with several transcripts of that name return
+    all of them.
+    '''
+
+    if mode == 'first-last':
+        cds_start, cds_end = ('min', 'max') if outer_cds else ('max', 'min')
+        return refseq.groupby(by).agg(gene=('name2', 'first'),
+                                      chrom=('chrom', 'first'),
+                                      txStart=('txStart', 'min'),
+                                      cdsStart=('cdsStart', cds_start),
+                                      txEnd=('txEnd', 'max'),
+                                      cdsEnd=('cdsEnd', cds_end),
+                                      strand=('strand', 'first'))
+
+    elif mode != 'longest-cds':
+        raise ValueError(f'Unknown mode: {mode}')
+
+    tx = refseq.reset_index(drop=True)
+    lengths, has_exons = cds_lengths(tx)
+
+    # Cds length per transcript name of each gene, only names with exons
+    # can be the longest
+    names = pd.DataFrame({'group': tx[by].values, 'name': tx['name'].values,
+                          'length': lengths, 'has_exons': has_exons})
+    names = names.groupby(['group', 'name'], sort=False).agg(
+        length=('length', 'sum'), has_exons=('has_exons', 'any'))
+    names['length'] = names['length'].where(names['has_exons'], -1)
+    longest = (names['length']
+               == names.groupby(level='group')['length'].transform('max'))
+
+    # Transcripts with the longest cds in refseq order, and their most
+    # upstream cds start according to the strand of the first of them
+    keys = pd.MultiIndex.from_arrays([tx[by].values, tx['name'].values])
+    cand = tx[longest.reindex(keys).values]
+    plus = cand.groupby(by)['strand'].transform('first') == '+'
+    upstream = np.where(plus, cand['cdsStart'], -cand['cdsEnd'])
+    first = upstream == (pd.Series(upstream, index=cand.index)
+                         .groupby(cand[by].values).transform('min').values)
+    chosen = cand[first].groupby(by)['name'].first()
+
+    cols = ['name2', 'chrom', 'txStart', 'cdsStart', 'txEnd', 'cdsEnd',
+            'strand', 'name']
+    genes = tx[tx['name'].values == chosen.reindex(tx[by]).values]
+    genes = genes.iloc[np.argsort(pd.factorize(genes[by], sort=True)[0],
+                                  kind='stable')]
+
+    return (genes.set_index(by)[cols].rename(columns={'name2': 'gene'})
+            .set_index('gene', append=True))
+
+
+class GeneIntervalIndex():
+    '''Index of collapsed gene spans (first txStart to last txEnd of each
+    name_chrom) by chromosome. Spans are sorted by start, so genes
+    overlapping a window are found with a binary search over starts,
+    bounded by the longest gene of the chromosome.
+    '''
+
+    def __init__(self, refseq: pd.DataFrame) -> None:
+
+        self.refseq = refseq
+        self.chroms = {}
+        if len(refseq) == 0:
+            return
+
+        # Row positions of refseq sorted by gene, and where each gene starts
+        # and ends in them
+        self.rows = np.lexsort((refseq['name_chrom'].values,
+                                refseq['chrom'].values))
+        genes = refseq.iloc[self.rows][['chrom', 'name_chrom']].values
+        row_start = np.concatenate(
+            [[0], np.flatnonzero((genes[1:] != genes[:-1]).any(axis=1)) + 1])
+        row_end = np.concatenate([row_start[1:], [len(genes)]])
+
+        spans = pd.DataFrame({
+            'chrom': genes[row_start, 0],
+            'name_chrom': genes[row_start, 1],
+            'txStart': np.minimum.reduceat(
+                refseq['txStart'].values[self.rows], row_start),
+            'txEnd': np.maximum.reduceat(
+                refseq['txEnd'].values[self.rows], row_start),
+            'row_start': row_start, 'row_end': row_end})
+
+        for chrom, chrom_spans in spans.groupby('chrom'):
+            chrom_spans = chrom_spans.sort_values('txStart', kind='stable')
+            self.chroms[chrom] = {
+                'name_chrom': chrom_spans['name_chrom'].values,
+                'txStart': chrom_spans['txStart'].values,
+                'txEnd': chrom_spans['txEnd'].values,
+                'row_start': chrom_spans['row_start'].values,
+                'row_end': chrom_spans['row_end'].values,
+                'max_length': (chrom_spans['txEnd']
+                               - chrom_spans['txStart']).max()}
+
+    def overlapping(self, chrom: str, start: int, end: int) -> np.ndarray:
+        # Positions (in the index) of genes of chrom with txStart <= end and
+        # txEnd >= start
+        if chrom not in self.chroms:
+            return np.array([], dtype=int)
+        genes = self.chroms[chrom]
+
+        lo = np.searchsorted(genes['txStart'], start - genes['max_length'],
+                             side='left')
+        hi = np.searchsorted(genes['txStart'], end, side='right')
+
+        return lo + np.flatnonzero(genes['txEnd'][lo:hi] >= start)
+
+    def genes(self, chrom: str, start: int, end: int) -> np.ndarray:
+        # Names (name_chrom) of genes of chrom overlapping start-end
+        idx = self.overlapping(chrom, start, end)
+        if chrom not in self.chroms:
+            return np.array([], dtype=object)
+
+        return self.chroms[chrom]['name_chrom'][idx]
+
+    def transcripts(self, chrom: str, start: int, end: int) -> pd.DataFrame:
+        # Refseq rows of all transcripts of genes of chrom overlapping
+        # start-end, in refseq order
+        idx = self.overlapping(chrom, start, end)
+        if len(idx) == 0:
+            return self.refseq.iloc[[]]
+        genes = self.chroms[chrom]
+
+        rows = np.concatenate([self.rows[s:e] for s, e
+                               in zip(genes['row_start'][idx],
+                                      genes['row_end'][idx])])
+
+        return self.refseq.iloc[np.sort(rows)]
+
+    def adjacent(self, chrom: str, start: int) -> list:
+        # Spans (name_chrom, txStart, txEnd) of the genes of chrom starting
+        # right before and right after start
+        if chrom not in self.chroms:
+            return []
+        genes = self.chroms[chrom]
+
+        idx = [np.searchsorted(genes['txStart'], start, side='left') - 1,
+               np.searchsorted(genes['txStart'], start, side='right')]
+
+        return [(genes['name_chrom'][i], genes['txStart'][i],
+                 genes['txEnd'][i])
+                for i in idx if 0 <= i < len(genes['txStart'])]
+
+
+class GeneSymbolIndex():
+    '''Gene symbols (name_chrom) of refseq annotations with their span
+    (chrom, first txStart, last txEnd), looked up in a dict, and sorted
+    case-insensitively for completing typed prefixes.
+    '''
+
+    def __init__(self, refseq: pd.DataFrame) -> None:
+
+        spans = refseq.groupby('name_chrom').agg(chrom=('chrom', 'first'),
+                                                 txStart=('txStart', 'min'),
+                                                 txEnd=('txEnd', 'max'))
+        self.spans = dict(zip(spans.index,
+                              zip(spans['chrom'], spans['txStart'].tolist(),
+                                  spans['txEnd'].tolist())))
+
+        symbols = spans.index.values.astype(str)
+        order = np.argsort(np.char.lower(symbols), kind='stable')
+        self.symbols = symbols[order]
+        self.lower = np.char.lower(self.symbols)
+
+    def lookup(self, symbol: str) -> Optional[tuple]:
+        # (chrom, start, end) of a symbol, None if it is not annotated
+        return self.spans.get(symbol)
+
+    def complete(self, prefix: str, limit: int = 100) -> list:
+        # Symbols starting with prefix, ignoring case, in alphabetical order
+        prefix = prefix.lower()
+        lo = np.searchsorted(self.lower, prefix, side='left')
+        hi = np.searchsorted(self.lower, prefix + '\uffff', side='left')
+
+        return self.symbols[lo:min(hi, lo + limit)].tolist()
+
+
 def get_exon_length(tx_exons: pd.DataFrame) -> pd.Series:
     length = tx_exons['reg_lims'].apply(
         lambda x: x[1] - x[0])
@@ -156,52 +368,93 @@ def contig_list_lims(lst):
     return lims
 
 
-def get_exon_regions(gene_pos: pd.DataFrame) -> pd.DataFrame:
+def cumcount(groups: np.ndarray) -> np.ndarray:
+    # Position of each element within its group, for sorted groups
+    return np.arange(len(groups)) - np.searchsorted(groups, groups,
+                                                    side='left')
+
+
+def get_exon_regions(gene_pos: pd.DataFrame,
+                     by: Optional[str] = None) -> pd.DataFrame:
     '''Returns dataframe with start and end positions of all gene exons and
     whether they are cds or utr. Eg.:
     name2	name	        exon_id	tx_id	reg_type	reg_lims
     JAK2	NM_001322195.1	2	    1	    exCds	    [5021987, 5022212]
     JAK2	NM_001322195.1	3	    1	    exCds	    [5029782, 5029905]
     JAK2	NM_004972.3	    126	    6	    exUtr	    [5021962, 5021986]
+
+    Exons are split into cds and utr regions by clipping their limits to
+    cdsStart and cdsEnd, for all transcripts at once. With by (eg.
+    'name_chrom'), transcripts and exons are numbered within each group, as
+    in gene_pos.groupby(by).apply(get_exon_regions).reset_index(drop=True).
     '''
 
-    exon = gene_pos.copy(deep=True)
-    exon = exon.reset_index(drop=True)
-    exon['tx_id'] = exon.index + 1
-
-    cols = ['exonStarts', 'exonEnds']
-    exon[cols] = exon[cols].applymap(lambda x: x.split(','))
-
-    exon['cdsRange'] = exon.apply(lambda x: range(x.cdsStart, x.cdsEnd),
-                                  axis=1)
-    exon['exonRange'] = (exon
-                         .apply(lambda t:
-                                [range(int(x), int(y)) for i, x
-                                 in enumerate(t['exonStarts']) for j, y
-                                 in enumerate(t['exonEnds']) if i == j
-                                 and x != '' and y != ''], axis=1))
-
-    exon = exon.explode('exonRange')
-    exon = exon.reset_index(drop=True)
-    exon['exon_id'] = exon.index + 1
-    exon = exon.drop(columns=[
-        # '#bin', 'score', 'exonFrames',
-        'exonStarts', 'exonEnds',
-        'cdsStartStat', 'cdsEndStat',
-        'cdsStart', 'cdsEnd'])
-
-    exon['exCds_lst'] = exon.apply(lambda t: [x for x in t.exonRange
-                                              if x in t.cdsRange], axis=1)
-    exon['exUtr_lst'] = exon.apply(lambda t: [x for x in t.exonRange
-                                              if x not in t.cdsRange], axis=1)
-
-    exon['exCds'] = exon.apply(lambda t: contig_list_lims(t.exCds_lst), axis=1)
-    exon['exUtr'] = exon.apply(lambda t: contig_list_lims(t.exUtr_lst), axis=1)
-
-    exon_regions = exon.melt(id_vars=['name2', 'name', 'exon_id', 'tx_id'],
-                             value_vars=['exCds', 'exUtr'],
-                             var_name='reg_type', value_name='reg_lims')
-    exon_regions = exon_regions.explode('reg_lims').dropna()
+    tx = gene_pos.reset_index(drop=True)
+    if by is None:
+        group = np.zeros(len(tx), dtype=int)
+    else:
+        group = pd.factorize(tx[by], sort=True)[0]
+        order = np.argsort(group, kind='stable')
+        tx = tx.iloc[order].reset_index(drop=True)
+        group = group[order]
+    tx_id = cumcount(group) + 1
+
+    # One row per exon
+    exon = pd.DataFrame({'tx': np.arange(len(tx)),
+                         'exonStarts': tx['exonStarts'].str.split(','),
+                         'exonEnds': tx['exonEnds'].str.split(',')})
+    exon = exon.explode(['exonStarts', 'exonEnds'])
+    exon = exon[(exon['exonStarts'] != '') & (exon['exonEnds'] != '')]
+
+    t = exon['tx'].values.astype(int)
+    ex_start = exon['exonStarts'].values.astype(np.int64)
+    ex_end = exon['exonEnds'].values.astype(np.int64)
+    cds_start = tx['cdsStart'].values[t]
+    cds_end = tx['cdsEnd'].values[t]
+    coding = cds_start < cds_end
+    ex_group = group[t]
+    exon_id = cumcount(ex_group) + 1
+
+    # Cds part of each exon, and utr parts before and after the cds (the
+    # whole exon for non-coding transcripts)
+    n = len(t)
+    reg_type = np.repeat([0, 1, 1], n)
+    part = np.repeat([0, 0, 1], n)
+    exon_idx = np.tile(np.arange(n), 3)
+    reg_start = np.concatenate([np.maximum(ex_start, cds_start),
+                                ex_start,
+                                np.where(coding,
+                                         np.maximum(ex_start, cds_end),
+                                         ex_end)])
+    reg_end = np.concatenate([np.minimum(ex_end, cds_end),
+                              np.where(coding,
+                                       np.minimum(ex_end, cds_start),
+                                       ex_end),
+                              ex_end])
+
+    # Drop empty parts and sort as cds regions of all exons followed by utr
+    # regions, by group
+    regs = np.flatnonzero(reg_start < reg_end)
+    regs = regs[np.lexsort((part[regs], exon_idx[regs], reg_type[regs],
+                            ex_group[exon_idx[regs]]))]
+    exon_idx = exon_idx[regs]
+    reg_t = t[exon_idx]
+
+    if by is None:
+        index = reg_type[regs] * n + exon_idx
+    else:
+        index = np.arange(len(regs))
+
+    exon_regions = pd.DataFrame(
+        {'name2': tx['name2'].values[reg_t],
+         'name': tx['name'].values[reg_t],
+         'exon_id': exon_id[exon_idx],
+         'tx_id': tx_id[reg_t],
+         'reg_type': np.where(reg_type[regs] == 0, 'exCds', 'exUtr')
+         .astype(object),
+         'reg_lims': [[s, e] for s, e in zip(reg_start[regs].tolist(),
+                                             reg_end[regs].tolist())]},
+        index=index)
 
     return exon_regions
 